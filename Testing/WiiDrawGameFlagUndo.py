@@ -323,11 +323,11 @@ class Painter(QtWidgets.QMainWindow):
             return
         QtGui.QCursor.setPos(self.mapToGlobal(QtCore.QPoint(pos[0], pos[1])))
 
-    def buttonEvents(self, report):
-        for button in report:
-            if button[0] == "B" and button[1]:
+    def buttonEvents(self, events):
+        for event in events:
+            if event.button == "B" and event.kind == wiimote.Buttons.PRESS:
                 pyautogui.mouseDown(button="left")
-            elif button[0] == "B" and not button[1]:
+            elif event.button == "B" and event.kind == wiimote.Buttons.RELEASE:
                 pyautogui.mouseUp(button="left")
 
 
@@ -0,0 +1,191 @@
+#!/usr/bin/env python3
+
+import math
+import sys
+import time
+import numpy as np
+sys.path.append('..')
+import wiimote
+import wiimote_capture
+import wiimote_drawing
+
+"""
+Compares the corner ordering of WiimoteDrawing.sort_tracking_points (order_corners())
+with the previous min/max search (legacy_sort() below) and prints the time per frame.
+Start as `python3 corner_ordering_check.py [capture files]`: frames with four visible
+IR points are taken from the given captures (see wiimote_capture.record()), by default
+from captures/simulated_sensor_bar.wmcap (600 reports of wiimote_sim at 100 Hz),
+plus synthetic rotated, skewed and degenerate frames.
+The legacy search returns None or duplicate corners for some degenerate frames, and for
+strongly rotated frames the extreme points it starts from are not the expected corners.
+Differing frames are therefore checked for a consistent legacy result: a convex, clockwise
+corner cycle starting with a long side. Exits with status 1 if the new ordering differs
+from such a result, or if it is not consistent itself for a non-degenerate frame.
+"""
+
+
+CAPTURES = ['captures/simulated_sensor_bar.wmcap']
+
+
+def legacy_sort(ir_points):
+    xmin, ymin = 100000, 100000
+    xmax, ymax = 0, 0
+    xmin_point, xmax_point, ymin_point, ymax_point = [(-1, -1) for p in range(4)]
+    for p in ir_points:
+        if p[0] < xmin:
+            xmin, xmin_point = p[0], p
+        if p[0] > xmax:
+            xmax, xmax_point = p[0], p
+        if p[1] < ymin:
+            ymin, ymin_point = p[1], p
+        if p[1] > ymax:
+            ymax, ymax_point = p[1], p
+    xmin_ymin_dist = math.hypot(xmin_point[0] - ymin_point[0], xmin_point[1] - ymin_point[1])
+    xmin_ymax_dist = math.hypot(xmin_point[0] - ymax_point[0], xmin_point[1] - ymax_point[1])
+    quadrant_num = 0 if (xmin_ymin_dist < xmin_ymax_dist) else 1
+    if quadrant_num == 0:
+        sorted_points = [ymin_point, xmax_point, ymax_point, xmin_point]
+    else:
+        sorted_points = [xmin_point, ymin_point, xmax_point, ymax_point]
+    return legacy_remove_sorting_errors(sorted_points, ir_points, quadrant_num,
+                                        [p[0] for p in ir_points], [p[1] for p in ir_points])
+
+
+def legacy_remove_sorting_errors(sorted_points, ir_points, quadrant_num, x_list, y_list, recursion_counter=0):
+    x_list_asc, y_list_asc = sorted(x_list), sorted(y_list)
+    point_order = [[['y', 'min'], ['x', 'max'], ['y', 'max'], ['x', 'min']],
+                   [['x', 'min'], ['y', 'min'], ['x', 'max'], ['y', 'max']]][quadrant_num]
+    avoidance = [[['x', 'max'], ['y', 'max'], ['x', 'min'], ['y', 'min']],
+                 [['y', 'max'], ['x', 'min'], ['y', 'min'], ['x', 'max']]][quadrant_num]
+    for dp in duplicates(sorted_points):
+        indices = [i for i, sp in enumerate(sorted_points) if str(sp) == str(dp)]
+        faulty_point_index, lowest_avoidance_rating = -1, 1000
+        if len(indices) > 2:
+            return
+        for i in indices:
+            p = sorted_points[i]
+            rating = x_list_asc.index(p[0]) if avoidance[i][0] == 'x' else y_list_asc.index(p[1])
+            if avoidance[i][1] == 'max':
+                rating = len(sorted_points) - rating
+            if rating < lowest_avoidance_rating:
+                lowest_avoidance_rating, faulty_point_index = rating, i
+        order_axis, boundary_type = point_order[faulty_point_index]
+        search_list = x_list_asc if order_axis == 'x' else y_list_asc
+        closest_similar_value = search_list[1] if boundary_type == 'min' else search_list[len(sorted_points) - 2]
+        for p in ir_points:
+            if (p[0] if order_axis == 'x' else p[1]) == closest_similar_value:
+                sorted_points[faulty_point_index] = p
+    if duplicates(sorted_points) and recursion_counter < 4:
+        legacy_remove_sorting_errors(sorted_points, ir_points, quadrant_num, x_list, y_list, recursion_counter + 1)
+    return sorted_points
+
+
+def duplicates(seq):
+    seen = set()
+    return list(set(x for x in seq if x in seen or seen.add(x)))
+
+
+def captured_frames(path):
+    records = wiimote_capture.load_capture(path)
+    data = records['data'][records['data'][:, 1] == 0x33]
+    ir = wiimote.decode_reports(data)['ir'] if len(data) else np.zeros((0, 4), wiimote.IR_OBJECT_DTYPE)
+    ir = ir[(ir['size'] > 0).all(axis=1)]
+    return np.stack([ir['x'], ir['y']], axis=-1).astype(np.int64)
+
+
+def synthetic_frames(seed=0):
+    """
+    Rectangles at all rotations up to +-80 degrees, with perspective skew and noise,
+    axis-aligned rectangles and squares (ties in the min/max search), and degenerate frames.
+    Returns the frames and the rotation of each frame in degrees (NaN for degenerate frames).
+    """
+    rng = np.random.RandomState(seed)
+    frames, angles = [], []
+    for angle in np.radians(np.arange(-80, 81, 1.0)):
+        for _ in range(20):
+            w, h = rng.uniform(150, 450), rng.uniform(50, 250)
+            corners = np.array([(-w, -h), (w, -h), (w, h), (-w, h)]) / 2
+            corners[:, 0] *= 1 + rng.uniform(-0.2, 0.2) * corners[:, 1] / h  # perspective
+            rot = np.array([[math.cos(angle), -math.sin(angle)], [math.sin(angle), math.cos(angle)]])
+            frames.append(corners @ rot.T + rng.normal(0, 2, (4, 2)) + rng.uniform((300, 250), (700, 500)))
+            angles.append(math.degrees(angle))
+    for w, h in [(300, 200), (200, 300), (200, 200), (201, 200)]:
+        for x, y in rng.randint(100, 600, (10, 2)):
+            frames.append(np.array([(x, y), (x + w, y), (x + w, y + h), (x, y + h)]))
+            angles.append(0.0)
+    for x, y in rng.randint(100, 600, (20, 2)):
+        frames.append(np.array([(x, y), (x + 100, y), (x + 100, y), (x, y + 50)]))  # duplicate
+        frames.append(np.array([(x, y), (x + 50, y + 10), (x + 100, y + 20), (x, y + 50)]))  # collinear
+        frames.append(np.array([(x, y)] * 4))
+        angles += [math.nan] * 3
+    frames = np.round(frames).astype(np.int64)
+    shuffled = np.array([frame[rng.permutation(4)] for frame in frames])  # input order is arbitrary
+    return np.concatenate([frames, shuffled]), np.array(angles * 2)
+
+
+def consistent(corners, tolerance=0.0):
+    """
+    True if `corners` is a convex cycle, clockwise on screen, that starts with a long side:
+    the first and third side are together at least as long as the other two
+    (minus `tolerance`, relative).
+    """
+    if corners is None or len(set(corners)) < 4:
+        return False
+    turns = [(b[0] - a[0]) * (c[1] - b[1]) - (b[1] - a[1]) * (c[0] - b[0])
+             for a, b, c in zip(corners, corners[1:] + corners[:1], corners[2:] + corners[:2])]
+    sides = [math.hypot(b[0] - a[0], b[1] - a[1]) for a, b in zip(corners, corners[1:] + corners[:1])]
+    return all(turn > 0 for turn in turns) and sides[0] + sides[2] >= (1 - tolerance) * (sides[1] + sides[3])
+
+
+def per_frame(func, frames):
+    start = time.perf_counter()
+    for points in frames:
+        func(points)
+    return (time.perf_counter() - start) / len(frames) * 1e6
+
+
+synthetic, angles = synthetic_frames()
+captured = [captured_frames(path) for path in sys.argv[1:] or CAPTURES]
+frames = np.concatenate([synthetic] + captured)
+angles = np.concatenate([angles] + [np.zeros(len(c)) for c in captured])  # recorded: no large rotation
+tuples = [[tuple(p) for p in frame.tolist()] for frame in frames]
+drawing = wiimote_drawing.WiimoteDrawing(None)
+
+equal = legacy_inconsistent = ambiguous = 0
+failures = []
+inconsistent_angles = []
+batch = wiimote_drawing.order_corners(frames).tolist()
+for points, angle, single, batched in zip(tuples, angles, map(drawing.sort_tracking_points, tuples), batch):
+    assert sorted(single) == sorted(points), "not a permutation of the input: %s" % single
+    assert single == [tuple(p) for p in batched], "batch and single frame differ: %s" % points
+    if not math.isnan(angle) and not consistent(single):
+        failures.append((points, None, single))
+    legacy = legacy_sort(list(points))
+    if legacy == single:
+        equal += 1
+    elif not consistent(legacy, 0.1):
+        legacy_inconsistent += 1
+        inconsistent_angles.append(abs(angle))
+    elif consistent(single) and consistent(legacy[1:] + legacy[:1], 0.1):
+        ambiguous += 1  # (nearly) square, both start corners are fine
+    else:
+        failures.append((points, legacy, single))
+
+print("%d frames (%d recorded): %d equal, %d near-square with another start corner" %
+      (len(frames), sum(map(len, captured)), equal, ambiguous))
+inconsistent_angles = np.array(inconsistent_angles)
+rotated = inconsistent_angles[~np.isnan(inconsistent_angles)]
+print("%d differ where the legacy result is inconsistent: %d degenerate, %d rotated by %.0f to %.0f degrees" %
+      (legacy_inconsistent, len(inconsistent_angles) - len(rotated), len(rotated),
+       rotated.min() if len(rotated) else math.nan, rotated.max() if len(rotated) else math.nan))
+print("%d failures" % len(failures))
+for points, legacy, single in failures[:10]:
+    print("  %s: legacy %s, new %s" % (points, legacy, single))
+
+valid = [p for p in tuples if legacy_sort(list(p)) is not None]
+print("legacy     %6.2f us/frame" % per_frame(lambda p: legacy_sort(list(p)), valid))
+print("new        %6.2f us/frame" % per_frame(drawing.sort_tracking_points, valid))
+start = time.perf_counter()
+wiimote_drawing.order_corners(frames)
+print("new batch  %6.2f us/frame" % ((time.perf_counter() - start) / len(frames) * 1e6))
+sys.exit(1 if failures else 0)
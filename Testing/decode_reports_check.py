@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+
+import sys
+import time
+import numpy as np
+sys.path.append('..')
+import wiimote
+import wiimote_capture
+import wiimote_loopback
+import wiimote_sim
+
+"""
+Compares wiimote.decode_reports() with the live decoders: the same 0x33 reports are
+passed to CommunicationHandler._handle of a WiiMote (connected to a LoopbackDevice,
+no Bluetooth needed) one by one and decoded as a batch. Buttons, accelerometer and
+the four IR slots (x, y, size; position only for visible objects) have to be equal.
+Start as `python3 decode_reports_check.py [capture files]`: random reports and
+the 0x33 reports of the given captures (see wiimote_capture.record()) are compared.
+Also checks that a simulated Wiimote with 0 to 4 visible IR points (the others sent
+as empty slots) yields that many objects.
+Exits with status 1 if any report differs or an IR object count is wrong.
+"""
+
+
+def random_reports(count, seed=0):
+    """
+    Random payloads, every tenth IR slot empty (0xff, as sent by the Wiimote).
+    """
+    rng = np.random.RandomState(seed)
+    reports = np.zeros((count, 22), dtype=np.uint8)
+    reports[:, 0] = 0xa1
+    reports[:, 1] = 0x33
+    reports[:, 2:19] = rng.randint(0, 256, (count, 17))
+    slots = reports[:, 7:19].reshape(count, 4, 3)
+    slots[rng.random_sample((count, 4)) < 0.1] = 0xff
+    return reports
+
+
+def captured_reports(path):
+    records = wiimote_capture.load_capture(path)
+    return np.array(records['data'][records['data'][:, 1] == 0x33])
+
+
+def simulated_ir_count(ir_points):
+    wm = wiimote_sim.connect_simulated(ir_points=ir_points)
+    time.sleep(0.3)  # let the report mode settle
+    count = wm.ir.count
+    wm.disconnect()
+    return count
+
+
+def live_decode(wm, reports):
+    """
+    Returns buttons (N,), acc (N, 3) and IR slots (N, 4, 3) as decoded by the WiiMote.
+    """
+    buttons = np.zeros(len(reports), dtype=np.uint16)
+    acc = np.zeros((len(reports), 3), dtype=np.uint16)
+    ir = np.zeros((len(reports), 4, 3), dtype=np.uint16)
+    for i, report in enumerate(reports):
+        wm._com._handle(report[:19].tobytes())
+        buttons[i] = wm.buttons._mask
+        acc[i] = wm.accelerometer._state
+        ir[i] = np.reshape(wm.ir._slots, (4, 3))
+    return buttons, acc, ir
+
+
+reports = np.concatenate([random_reports(20000)] + [captured_reports(path) for path in sys.argv[1:]])
+device = wiimote_loopback.LoopbackDevice()
+# no receive thread: reports are only decoded by the calls below
+wm = wiimote.WiiMote('loopback', device.MODEL, threaded=False, transport=device.connect)
+
+start = time.perf_counter()
+buttons, acc, ir = live_decode(wm, reports)
+live_time = time.perf_counter() - start
+start = time.perf_counter()
+decoded = wiimote.decode_reports(reports)
+batch_time = time.perf_counter() - start
+
+visible = decoded['ir']['size'] > 0
+failures = {'buttons': decoded['buttons'] != buttons,
+            'acc': (decoded['acc'] != acc).any(axis=1),
+            'ir size': (decoded['ir']['size'] != ir[:, :, 2]).any(axis=1),
+            'ir x': (visible & (decoded['ir']['x'] != ir[:, :, 0])).any(axis=1),
+            'ir y': (visible & (decoded['ir']['y'] != ir[:, :, 1])).any(axis=1)}
+print("%d reports, %d IR slots empty" % (len(reports), (~visible).sum()))
+for field, differs in failures.items():
+    print("%-8s %d differ" % (field, differs.sum()))
+    for i in np.flatnonzero(differs)[:5]:
+        print("  %s" % reports[i, :19].tolist())
+print("live decoders  %8.0f reports/s" % (len(reports) / live_time))
+print("decode_reports %8.0f reports/s" % (len(reports) / batch_time))
+wm.disconnect()
+device.stop()
+
+wrong_counts = 0
+for ir_points in range(5):
+    count = simulated_ir_count(ir_points)
+    print("simulated Wiimote, %d IR points: %d objects" % (ir_points, count))
+    wrong_counts += count != ir_points
+sys.exit(1 if wrong_counts or any(differs.any() for differs in failures.values()) else 0)
@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+
+import math
+import sys
+import time
+import numpy as np
+sys.path.append('..')
+
+"""
+Compares WiimoteDrawing.calc_drawing_point (closed form) with the previous matrix based
+implementation (reference() below) on random sensor bar positions and on a moving trace
+(consecutive frames of a sensor bar moving like in a drawing session) and prints the
+time per frame. Start as `python3 homography_benchmark.py [frames]`.
+"""
+
+import wiimote_drawing
+
+
+def reference(self, ir_points):
+    sx1, sy1 = ir_points[0]
+    sx2, sy2 = ir_points[1]
+    sx3, sy3 = ir_points[2]
+    sx4, sy4 = ir_points[3]
+    source_points_123 = np.matrix([[sx1, sx2, sx3], [sy1, sy2, sy3], [1, 1, 1]])
+    source_point_4 = [[sx4], [sy4], [1]]
+    l, m, t = np.ravel(np.linalg.solve(source_points_123, source_point_4))
+    unit_to_source = np.matrix([[l * sx1, m * sx2, t * sx3], [l * sy1, m * sy2, t * sy3], [l, m, t]])
+    rectangle_long_side_dist = math.hypot(sx2 - sx1, sy2 - sy1)
+    rectangle_short_side_dist = math.hypot(sx3 - sx2, sy3 - sy2)
+    origin_x = (self.IR_CAM_X - rectangle_long_side_dist) / 2 - rectangle_long_side_dist / 2
+    origin_y = (self.IR_CAM_Y - rectangle_short_side_dist) / 2 - rectangle_short_side_dist / 2
+    max_x = self.DEST_W - origin_x
+    max_y = self.DEST_H - origin_y
+    dx1, dy1, dx2, dy2, dx3, dy3, dx4, dy4 = origin_x, origin_y, max_x, origin_y, max_x, max_y, origin_x, max_y
+    dest_points_123 = np.matrix([[dx1, dx2, dx3], [dy1, dy2, dy3], [1, 1, 1]])
+    l, m, t = np.ravel(np.linalg.solve(dest_points_123, np.matrix([[dx4], [dy4], [1]])))
+    unit_to_dest = np.matrix([[l * dx1, m * dx2, t * dx3], [l * dy1, m * dy2, t * dy3], [l, m, t]])
+    source_to_dest = unit_to_dest @ np.linalg.inv(unit_to_source)
+    x, y, z = (source_to_dest @ np.matrix([[self.IR_CAM_X / 2], [self.IR_CAM_Y / 2], [1]])).A1
+    return x / z, self.DEST_H - y / z
+
+
+def random_frames(count, seed=0):
+    """
+    Sorted corners of a rotated, scaled and slightly skewed sensor bar rectangle.
+    """
+    rng = np.random.RandomState(seed)
+    frames = np.empty((count, 4, 2))
+    for i in range(count):
+        cx, cy = rng.uniform(300, 700), rng.uniform(250, 500)
+        w, h = rng.uniform(100, 400), rng.uniform(60, 250)
+        angle = rng.uniform(-0.5, 0.5)
+        corners = np.array([(-w, -h), (w, -h), (w, h), (-w, h)]) / 2 + rng.normal(0, 5, (4, 2))
+        rot = np.array([[math.cos(angle), -math.sin(angle)], [math.sin(angle), math.cos(angle)]])
+        frames[i] = np.round(corners @ rot.T + (cx, cy))
+    return frames
+
+
+def moving_frames(count, rate=100, seed=0):
+    """
+    Sorted corners of a sensor bar that moves, rotates and changes its distance smoothly,
+    with 0.5 px noise, one frame per report at `rate` Hz.
+    """
+    rng = np.random.RandomState(seed)
+    t = np.arange(count)[:, None] / rate
+    cx, cy = 512 + 250 * np.cos(1.3 * t), 384 + 180 * np.sin(0.9 * t)
+    angle, scale = 0.3 * np.sin(0.5 * t), 1 + 0.3 * np.sin(0.2 * t)
+    w, h = 160 * scale, 60 * scale
+    frames = np.empty((count, 4, 2))
+    for i, (dx, dy) in enumerate([(-1, -1), (1, -1), (1, 1), (-1, 1)]):
+        frames[:, i, 0] = (cx + dx * w * np.cos(angle) - dy * h * np.sin(angle))[:, 0]
+        frames[:, i, 1] = (cy + dx * w * np.sin(angle) + dy * h * np.cos(angle))[:, 0]
+    return np.round(frames + rng.normal(0, 0.5, frames.shape))
+
+
+def per_frame(func, frames):
+    start = time.perf_counter()
+    for points in frames:
+        func(points)
+    return (time.perf_counter() - start) / len(frames) * 1e6
+
+
+count = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+drawing = wiimote_drawing.WiimoteDrawing(None)
+for name, frames in [('random', random_frames(count)), ('moving', moving_frames(count))]:
+    tuples = [[tuple(p) for p in frame.tolist()] for frame in frames]
+    expected = np.array([reference(drawing, points) for points in tuples])
+    closed_form = np.array([drawing.calc_drawing_point(points) for points in tuples])
+    batch = drawing.calc_drawing_points(frames)
+    print("%s frames, max deviation: closed form %.2e px, batch %.2e px" %
+          (name, np.abs(closed_form - expected).max(), np.abs(batch - expected).max()))
+
+    t_ref = per_frame(lambda p: reference(drawing, p), tuples)
+    t_new = per_frame(drawing.calc_drawing_point, tuples)
+    start = time.perf_counter()
+    drawing.calc_drawing_points(frames)
+    t_batch = (time.perf_counter() - start) / count * 1e6
+    print("  matrix reference  %7.2f us/frame" % t_ref)
+    print("  closed form       %7.2f us/frame (%.0fx)" % (t_new, t_ref / t_new))
+    print("  batch             %7.2f us/frame (%.0fx)" % (t_batch, t_ref / t_batch))
@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+
+import math
+import random
+import sys
+import time
+sys.path.append('..')
+import wiimote_drawing
+import wiimote_sim
+
+"""
+Checks the tracking of the sensor bar corners (wiimote_drawing.IRTracker) when one
+corner is not visible and has to be predicted from the other three.
+Start as `python3 ir_tracker_check.py`.
+1. A synthetic 100 Hz sequence: the sensor bar moves in circles, rotates and changes its
+   distance; one corner is hidden for 1 s out of every 3 s, and the IR slots are
+   shuffled now and then. The predicted corner is compared with the true one, and the
+   drawing point with the one computed from the full quad.
+2. A simulated Wiimote (wiimote_sim) that shows only three IR points for a while:
+   the hidden corner of its axis-aligned rectangle is known from the other three.
+Exits with status 1 if a frame with three points is not tracked or a prediction
+error exceeds the limits below.
+"""
+
+MAX_CORNER_ERROR = 10.0  # camera pixels
+MAX_MEDIAN_CORNER_ERROR = 4.0
+MAX_SIMULATED_ERROR = 2.0  # the simulated rectangle does not change its shape
+
+
+def synthetic_sequence(count=6000, rate=100, seed=2):
+    """
+    Returns the true quads and the visible points of each frame.
+    """
+    rng = random.Random(seed)
+    quads, frames = [], []
+    for i in range(count):
+        t = i / rate
+        cx, cy = 512 + 250 * math.cos(t * 1.3), 384 + 180 * math.sin(t * 0.9)
+        angle, scale = 0.3 * math.sin(t * 0.5), 1 + 0.3 * math.sin(t * 0.2)
+        w, h = 160 * scale, 60 * scale
+        quad = [(cx + dx * math.cos(angle) - dy * math.sin(angle), cy + dx * math.sin(angle) + dy * math.cos(angle))
+                for dx, dy in [(-w, -h), (w, -h), (w, h), (-w, h)]]
+        quad = [(round(x + rng.gauss(0, 0.5)), round(y + rng.gauss(0, 0.5))) for x, y in quad]
+        points = list(quad)
+        if (i // 300) % 3 == 1:
+            del points[(i // 900) % 4]
+        if i % 500 == 0:
+            rng.shuffle(points)  # the camera assigns new slots
+        quads.append(quad)
+        frames.append(points)
+    return quads, frames
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(int(len(values) * p), len(values) - 1)] if values else math.nan
+
+
+def check_synthetic():
+    quads, frames = synthetic_sequence()
+    tracker = wiimote_drawing.IRTracker()
+    drawing = wiimote_drawing.WiimoteDrawing(None)
+    corner_errors, point_errors, untracked = [], [], 0
+    for quad, points in zip(quads, frames):
+        corners = tracker.update(points)
+        if len(points) != 3:
+            continue
+        if corners is None:
+            untracked += 1
+            continue
+        truth = wiimote_drawing.sort_corners(quad)
+        i = tracker.predicted
+        corner_errors.append(math.hypot(corners[i][0] - truth[i][0], corners[i][1] - truth[i][1]))
+        x, y = drawing.calc_drawing_point(corners)
+        ref_x, ref_y = drawing.calc_drawing_point(truth)
+        point_errors.append(math.hypot(x - ref_x, y - ref_y))
+    print("synthetic: %d frames with a hidden corner, %d not tracked, %d resorts" %
+          (untracked + len(corner_errors), untracked, tracker.resorts))
+    print("  predicted corner error: median %.1f, p99 %.1f, max %.1f camera px" %
+          (percentile(corner_errors, 0.5), percentile(corner_errors, 0.99), max(corner_errors)))
+    print("  drawing point error:    median %.1f, p99 %.1f, max %.1f px (%dx%d)" %
+          (percentile(point_errors, 0.5), percentile(point_errors, 0.99), max(point_errors),
+           drawing.DEST_W, drawing.DEST_H))
+    return (untracked == 0 and max(corner_errors) <= MAX_CORNER_ERROR and
+            percentile(corner_errors, 0.5) <= MAX_MEDIAN_CORNER_ERROR)
+
+
+def check_simulated():
+    wm = wiimote_sim.connect_simulated(rate=200)
+    tracker = wiimote_drawing.IRTracker()
+    errors, untracked = [], [0]
+
+    def on_ir(points, seq, timestamp):
+        corners = tracker.update([(int(x), int(y)) for x, y in points[:, 1:3].tolist()])
+        if len(points) != 3:
+            return
+        if corners is None:
+            untracked[0] += 1
+            return
+        xs, ys = points[:, 1].tolist(), points[:, 2].tolist()
+        hidden = (min(xs), max(ys))  # the device hides its 4th corner, bottom left
+        x, y = corners[tracker.predicted]
+        errors.append(math.hypot(x - hidden[0], y - hidden[1]))
+
+    time.sleep(0.3)  # let the report mode settle
+    wm.ir.register_callback(on_ir, raw=True)
+    time.sleep(0.5)
+    wm.device.ir_points = 3
+    time.sleep(1.0)
+    wm.device.ir_points = 4
+    time.sleep(0.2)
+    wm.disconnect()
+    print("simulated: %d frames with a hidden corner, %d not tracked, prediction error max %.1f camera px" %
+          (len(errors) + untracked[0], untracked[0], max(errors) if errors else math.nan))
+    return bool(errors) and untracked[0] == 0 and max(errors) <= MAX_SIMULATED_ERROR
+
+
+ok = check_synthetic()
+ok = check_simulated() and ok
+sys.exit(0 if ok else 1)
@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+
+import math
+import sys
+import numpy as np
+sys.path.append('..')
+import pointer_filter
+
+"""
+Lag versus jitter of the pointer filters.
+Start as `python3 pointer_filter_benchmark.py [capture files]`.
+Without arguments a synthetic 100 Hz trace is used: strokes between random targets and
+pauses, with 4 px measurement noise, so lag and jitter are measured against the true path.
+With capture files (see wiimote_capture.record()) the pointer is computed from the recorded
+IR reports like in WiimoteDrawing, and the raw pointer serves as reference for the lag.
+  jitter  RMS deviation of the filtered pointer from its 0.2 s moving average while the
+          pointer rests, from 0.3 s after a stroke on (px)
+  lag     time shift of the filtered path that best matches the reference while moving (ms)
+  error   RMS deviation from the reference while moving, after removing the lag (px)
+"""
+
+FILTERS = [('none', {}),
+           ('exponential', {}),  # the former fixed EMA
+           ('exponential', {'time_constant': 0.1}),
+           ('one_euro', {}),
+           ('one_euro', {'min_cutoff': 0.5, 'beta': 0.02}),
+           ('kalman', {}),
+           ('kalman', {'acceleration': 10000.0})]
+
+
+def synthetic_trace(seconds=60, rate=100, noise=4.0, seed=0):
+    """
+    Returns times, true points and measured points (N, 2).
+    """
+    rng = np.random.RandomState(seed)
+    times = np.arange(0, seconds, 1.0 / rate)
+    position, path = np.array([960.0, 540.0]), []
+    while len(path) < len(times):
+        path += [position] * int(rng.uniform(0.3, 1.0) * rate)  # pause
+        target = rng.uniform((200, 100), (1720, 980))
+        s = np.linspace(0, 1, int(rng.uniform(0.2, 0.8) * rate))[:, None]
+        path += list(position + (target - position) * (10 * s**3 - 15 * s**4 + 6 * s**5))  # minimum jerk
+        position = target
+    truth = np.array(path[:len(times)])
+    return times, truth, truth + rng.normal(0, noise, truth.shape)
+
+
+def captured_trace(path):
+    """
+    Returns times, None and the raw drawing points of the recorded session at `path`.
+    """
+    import wiimote
+    import wiimote_capture
+    import wiimote_drawing
+    records = wiimote_capture.load_capture(path)
+    records = records[records['data'][:, 1] == 0x33]
+    ir = wiimote.decode_reports(records['data'])['ir'] if len(records) else None
+    drawing = wiimote_drawing.WiimoteDrawing(None)
+    tracker = wiimote_drawing.IRTracker()
+    times, points = [], []
+    for t, frame in zip(records['time'].tolist(), ir if ir is not None else []):
+        visible = [(int(obj['x']), int(obj['y'])) for obj in frame if obj['size'] > 0]
+        corners = tracker.update(visible)
+        if corners is not None:
+            point = drawing.calc_drawing_point(corners)
+            if point != (-1, -1):
+                times.append(t)
+                points.append(point)
+    return np.array(times), None, np.array(points).reshape(-1, 2)
+
+
+def apply(pointer, times, measured):
+    return np.array([pointer.filter(tuple(p), t) for t, p in zip(times.tolist(), measured.tolist())])
+
+
+def evaluate(times, reference, filtered, moving, settle=0.3):
+    stroke_end = np.maximum.accumulate(np.where(moving, times, -math.inf))
+    still = ~moving & (times - stroke_end > settle)
+    window = max(int(0.2 / np.median(np.diff(times))), 1)
+    deviation = (filtered - smooth(filtered, window))[still]
+    jitter = math.sqrt(np.mean(np.sum(deviation ** 2, axis=1))) if still.any() else math.nan
+    best = (math.inf, 0)
+    for lag in np.arange(0, 0.2, 0.001):
+        shifted = np.stack([np.interp(times - lag, times, reference[:, k]) for k in range(2)], axis=1)
+        error = math.sqrt(np.mean(np.sum((filtered[moving] - shifted[moving]) ** 2, axis=1)))
+        best = min(best, (error, lag))
+    return jitter, best[1] * 1000, best[0]
+
+
+def smooth(points, width):
+    kernel = np.ones(width) / width
+    padded = np.pad(points, ((width // 2, width - 1 - width // 2), (0, 0)), mode='edge')
+    return np.stack([np.convolve(padded[:, k], kernel, mode='valid') for k in range(2)], axis=1)
+
+
+def moving_mask(times, points, threshold=100.0):
+    """
+    True where the (smoothed) pointer moves faster than `threshold` px/s.
+    """
+    smoothed = smooth(points, 15)
+    speed = np.hypot(*np.gradient(smoothed, times, axis=0).T)
+    return speed > threshold
+
+
+traces = [captured_trace(path) for path in sys.argv[1:]] or [synthetic_trace()]
+for times, truth, measured in traces:
+    if len(times) < 100:
+        print("trace too short")
+        continue
+    if truth is not None:
+        reference, moving = truth, moving_mask(times, truth)
+    else:
+        reference, moving = measured, moving_mask(times, measured)
+    print("%d points, %.0f s, %.0f%% moving" % (len(times), times[-1] - times[0], 100 * moving.mean()))
+    print("%-56s %8s %8s %8s" % ("filter", "jitter", "lag", "error"))
+    for name, params in FILTERS:
+        pointer = pointer_filter.filter_by_name(name, **params)
+        jitter, lag, error = evaluate(times, reference, apply(pointer, times, measured), moving)
+        print("%-56s %6.2fpx %6.0fms %6.1fpx" % (pointer, jitter, lag, error))
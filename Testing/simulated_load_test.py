@@ -0,0 +1,37 @@
+#!/usr/bin/env python3
+
+import sys
+import time
+sys.path.append('..')
+import wiimote
+import wiimote_sim
+
+"""
+Load test with simulated Wiimotes, no Bluetooth hardware needed.
+Start as `python3 simulated_load_test.py [controllers] [rate in Hz] [seconds]`.
+All controllers are served by one WiimoteManager; prints the received report rate
+per controller and the CPU time used by the process.
+"""
+
+num_controllers = int(sys.argv[1]) if len(sys.argv) > 1 else 8
+rate = float(sys.argv[2]) if len(sys.argv) > 2 else 500
+duration = float(sys.argv[3]) if len(sys.argv) > 3 else 5
+
+manager = wiimote.WiimoteManager()
+wiimotes = [wiimote_sim.connect_simulated(rate, manager=manager, controller_id=i, dropout=0.001)
+            for i in range(num_controllers)]
+time.sleep(0.5)  # let the report mode settle
+
+start_seq = [wm.samples.last_seq for wm in wiimotes]
+start, cpu_start = time.monotonic(), time.process_time()
+time.sleep(duration)
+elapsed, cpu = time.monotonic() - start, time.process_time() - cpu_start
+
+total = 0
+for wm, seq in zip(wiimotes, start_seq):
+    received = wm.samples.last_seq - seq
+    total += received
+    print("controller %d: %7.1f reports/s, %d dropped by the device" %
+          (wm.controller_id, received / elapsed, wm.device.dropped))
+print("%.0f reports/s in total, CPU %.1f%%" % (total / elapsed, 100 * cpu / elapsed))
+manager.disconnect_all()
@@ -32,10 +32,7 @@ patterns = [[1, 0, 0, 0],
             [0, 0, 1, 0],
             [0, 1, 0, 0],
             [1, 0, 0, 0]]
-for i in range(5):
-    for p in patterns:
-        wm.leds = p
-        time.sleep(0.05)
+wm.leds.animate(patterns, interval=0.05, repeat=5)  # runs in the background
 
 
 def print_ir(ir_data):
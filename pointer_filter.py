@@ -0,0 +1,168 @@
+#!/usr/bin/env python3
+# coding: utf-8
+
+# Smoothing filters for the drawing point
+#
+# All filters take a point and the time it was measured (time.monotonic() or the report
+# time) and return the filtered point, so they behave the same at any report rate and
+# when reports are dropped. Construct with filter_by_name() to select a filter by name,
+# e.g. from a config file:
+#   WiimoteDrawing(wm, pointer_filter=pointer_filter.filter_by_name('one_euro', beta=0.01))
+#
+# One Euro filter: Casiez, Roussel, Vogel - "1€ Filter: A Simple Speed-based Low-pass Filter
+# for Noisy Input in Interactive Systems", CHI 2012.
+
+import math
+
+
+def filter_by_name(name, **params):
+    """
+    Returns a new filter of type `name` ('none', 'exponential', 'one_euro' or 'kalman')
+    with the given parameters.
+    """
+    try:
+        cls = FILTERS[name]
+    except KeyError:
+        raise ValueError("unknown pointer filter %r, choose one of %s" % (name, ", ".join(sorted(FILTERS))))
+    return cls(**params)
+
+
+class PointerFilter(object):
+    """
+    Base class, passes points through unchanged.
+    """
+
+    def filter(self, point, timestamp):
+        """
+        Returns the filtered (x, y) for the measured `point` at `timestamp` (in seconds).
+        """
+        return point
+
+    def reset(self):
+        """
+        Forgets the previous points, e.g. when the pointer was lost.
+        """
+        pass
+
+    def __repr__(self):
+        params = ", ".join("%s=%r" % (key, value) for key, value in sorted(self.__dict__.items())
+                           if not key.startswith('_'))
+        return "%s(%s)" % (type(self).__name__, params)
+
+
+class ExponentialFilter(PointerFilter):
+    """
+    Exponential moving average with a fixed `time_constant` (seconds). The default
+    corresponds to the former fixed weight of 0.3 for the new point at 60 frames per second.
+    """
+
+    def __init__(self, time_constant=0.0467):
+        self.time_constant = time_constant
+        self.reset()
+
+    def reset(self):
+        self._point = None
+        self._time = None
+
+    def filter(self, point, timestamp):
+        if self._point is None:
+            self._point, self._time = point, timestamp
+            return point
+        dt = max(timestamp - self._time, 0.0)
+        weight = 1.0 - math.exp(-dt / self.time_constant) if self.time_constant > 0 else 1.0
+        x, y = self._point
+        self._point = (x + weight * (point[0] - x), y + weight * (point[1] - y))
+        self._time = timestamp
+        return self._point
+
+
+class OneEuroFilter(PointerFilter):
+    """
+    Low-pass filter whose cutoff frequency rises with the speed of the pointer: still
+    points are smoothed with `min_cutoff` (Hz) to remove jitter, fast strokes get
+    `min_cutoff + beta * speed` (speed in pixels per second) to reduce lag.
+    `d_cutoff` (Hz) smooths the speed estimate.
+    """
+
+    def __init__(self, min_cutoff=1.0, beta=0.01, d_cutoff=1.0):
+        self.min_cutoff = min_cutoff
+        self.beta = beta
+        self.d_cutoff = d_cutoff
+        self.reset()
+
+    def reset(self):
+        self._point = None
+        self._speed = (0.0, 0.0)
+        self._time = None
+
+    @staticmethod
+    def _alpha(cutoff, dt):
+        tau = 1.0 / (2 * math.pi * cutoff)
+        return 1.0 / (1.0 + tau / dt)
+
+    def filter(self, point, timestamp):
+        if self._point is None:
+            self._point, self._time = point, timestamp
+            return point
+        dt = timestamp - self._time
+        if dt <= 0:
+            return self._point
+        x, y = self._point
+        a_d = self._alpha(self.d_cutoff, dt)
+        dx = self._speed[0] + a_d * ((point[0] - x) / dt - self._speed[0])
+        dy = self._speed[1] + a_d * ((point[1] - y) / dt - self._speed[1])
+        a = self._alpha(self.min_cutoff + self.beta * math.hypot(dx, dy), dt)
+        self._point = (x + a * (point[0] - x), y + a * (point[1] - y))
+        self._speed = (dx, dy)
+        self._time = timestamp
+        return self._point
+
+
+class KalmanFilter(PointerFilter):
+    """
+    Constant velocity Kalman filter, x and y are filtered independently.
+    `acceleration` is the standard deviation of the (random) acceleration of the pointer
+    in pixels/s², `noise` the standard deviation of the measured point in pixels.
+    A higher ratio acceleration / noise follows fast strokes more closely.
+    """
+
+    def __init__(self, acceleration=3000.0, noise=5.0):
+        self.acceleration = acceleration
+        self.noise = noise
+        self.reset()
+
+    def reset(self):
+        self._axes = None  # per axis: [position, velocity, P00, P01, P11]
+        self._time = None
+
+    def filter(self, point, timestamp):
+        if self._axes is None:
+            r = self.noise * self.noise
+            self._axes = [[point[0], 0.0, r, 0.0, 1e6], [point[1], 0.0, r, 0.0, 1e6]]
+            self._time = timestamp
+            return point
+        dt = max(timestamp - self._time, 0.0)
+        self._time = timestamp
+        q = self.acceleration * self.acceleration
+        q00, q01, q11 = q * dt ** 4 / 4, q * dt ** 3 / 2, q * dt * dt
+        r = self.noise * self.noise
+        for axis, measured in zip(self._axes, point):
+            pos, vel, p00, p01, p11 = axis
+            # predict
+            pos += vel * dt
+            p00 += dt * (2 * p01 + dt * p11) + q00
+            p01 += dt * p11 + q01
+            p11 += q11
+            # update
+            s = p00 + r
+            k0, k1 = p00 / s, p01 / s
+            residual = measured - pos
+            axis[:] = [pos + k0 * residual, vel + k1 * residual,
+                       (1 - k0) * p00, (1 - k0) * p01, p11 - k1 * p01]
+        return self._axes[0][0], self._axes[1][0]
+
+
+FILTERS = {'none': PointerFilter,
+           'exponential': ExponentialFilter,
+           'one_euro': OneEuroFilter,
+           'kalman': KalmanFilter}
@@ -16,6 +16,11 @@ import qimage2ndarray
 
 words = [line.rstrip('\n') for line in open('categories.txt')]
 
+# Sound cues for the Wiimote speaker, encoded once at startup
+CUE_ROUND_START = wiimote.Sound.tone([660, 990], 0.12)
+CUE_POINT = wiimote.Sound.tone([660, 880, 1320], 0.1)
+CUE_TIME_UP = wiimote.Sound.tone([440, 330], 0.2)
+
 # Source: https://github.com/baoboa/pyqt5/blob/master/examples/widgets/scribble.py
 # Used the scribble.py example as basis for the drawing area. The saveImage function was overwritten with the creation
 # of the qimage2ndarray. For this, we are using the python extension: https://github.com/hmeine/qimage2ndarray
@@ -156,7 +161,10 @@ class ScribbleArea(QtWidgets.QWidget):
 
 
 class Painter(QtWidgets.QMainWindow):
-    def __init__(self, wiimote, wiidraw):
+    # emitted by the connection supervisor thread, handled on the Qt thread
+    wiimote_connected = QtCore.pyqtSignal(object)
+
+    def __init__(self, supervisor=None):
         super(Painter, self).__init__()
         self.ui = uic.loadUi("DrawGame.ui", self)
         self.time = 30
@@ -196,10 +204,24 @@ class Painter(QtWidgets.QMainWindow):
                 el.setGeometry(QtCore.QRect(el.x() * self.scaleFactorWidth, el.y() * self.scaleFactorHeight,
                                             el.width() * self.scaleFactorWidth, el.height() * self.scaleFactorHeight))
 
+        # the UI works with the mouse until the Wiimote is connected
+        self.wiimote = None
+        self.wiidraw = None
+        self.wiimote_connected.connect(self.attach_wiimote)
+        if supervisor is not None:
+            supervisor.on_connect = self.wiimote_connected.emit
+            supervisor.start()
+
+    # Called when the Wiimote is connected. After a reconnect the callbacks are still registered
+    def attach_wiimote(self, wm):
+        if self.wiimote is wm:
+            return
+        self.wiimote = wm
         try:
-            wiimote.buttons.register_callback(self.buttonEvents)
-            wiidraw.register_callback(self.setMousePos)
-            wiidraw.start_processing()
+            self.wiidraw = wiimote_drawing.init(wm)
+            wm.buttons.register_callback(self.button_events)
+            self.wiidraw.register_callback(self.set_mouse_pos)
+            self.wiidraw.start_processing()
         except:
             print(sys.exc_info()[0])
 
@@ -293,6 +315,12 @@ class Painter(QtWidgets.QMainWindow):
             self.ui.kiGuess.setText("I think it is: %s" % self.guess)
             self.t = Thread(target=self.countdown)
             self.t.start()
+            self.play_cue(CUE_ROUND_START)
+
+    # Plays a sound on the Wiimote speaker without blocking
+    def play_cue(self, sound):
+        if self.wiimote is not None and self.wiimote.connected:
+            self.wiimote.speaker.play(sound)
 
     # Set new guess
     def change_guess(self, guess):
@@ -334,8 +362,10 @@ class Painter(QtWidgets.QMainWindow):
                 self.scoreTeamTwo = self.scoreTeamTwo + 1
             self.ui.kiGuess.setText(
                 "Oh i know, the Word is: %s. Team %s gets 1 Point!" % (self.guess, self.currentTeam))
+            self.play_cue(CUE_POINT)
         else:
             self.ui.kiGuess.setText("Sorry, i couldn't guess the word!")
+            self.play_cue(CUE_TIME_UP)
 
         self.ui.team1Score.display(self.scoreTeamOne)
         self.ui.team2Score.display(self.scoreTeamTwo)
@@ -377,33 +407,22 @@ class Painter(QtWidgets.QMainWindow):
 
     # Button events for the Wiimote. Used PyAutoGui for interaction with app
     #  (https://pyautogui.readthedocs.io/en/latest/)
-    def button_events(self, report):
-        for button in report:
-            if button[0] == "A" and not button[1]:
+    # The wiimote module detects presses/releases, see wiimote.ButtonEvent
+    def button_events(self, events):
+        for event in events:
+            if event.button == "A" and event.kind == wiimote.Buttons.RELEASE:
                 self.cw.undo()
-            if button[0] == "B" and button[1]:
+            if event.button == "B" and event.kind == wiimote.Buttons.PRESS:
                 pyautogui.mouseDown(button="left")
-            elif button[0] == "B" and not button[1]:
+            elif event.button == "B" and event.kind == wiimote.Buttons.RELEASE:
                 pyautogui.mouseUp(button="left")
 
 
-# Establish connection to Wiimote
-def connect_wiimote(btaddr="18:2a:7b:f4:bc:65", attempt=0):
+# Connection to the Wiimote, established (and re-established) in the background
+def connect_wiimote(btaddr="18:2a:7b:f4:bc:65"):
     if len(btaddr) == 17:
         print("connecting wiimote " + btaddr + "..")
-        w = None
-        try:
-            w = wiimote.connect(btaddr)
-        except:
-            print(sys.exc_info())
-            pass
-        if w is None:
-            print("couldn't connect wiimote. tried it " + str(attempt) + " times")
-            time.sleep(3)
-            return connect_wiimote(btaddr, attempt + 1)
-        else:
-            print("succesfully connected wiimote")
-            return w
+        return wiimote.ConnectionSupervisor(btaddr, on_disconnect=lambda wm: print("lost wiimote, reconnecting.."))
     else:
         print("bluetooth address has to be 17 characters long")
         return None
@@ -411,13 +430,19 @@ def connect_wiimote(btaddr="18:2a:7b:f4:bc:65", attempt=0):
 
 def main():
     app = QtWidgets.QApplication(sys.argv)
-    wiimote, wiidraw = None, None
+    supervisor = None
 
-    if len(sys.argv) > 1:
-        wiimote = connect_wiimote(sys.argv[1])
-        wiidraw = wiimote_drawing.init(wiimote)
+    if len(sys.argv) > 1 and sys.argv[1] == '--last':
+        # reconnect to the Wiimote that was used last
+        devices = wiimote.DeviceCache.default().devices()
+        if devices:
+            supervisor = connect_wiimote(devices[0][0])
+        else:
+            print("no wiimote has been connected yet")
+    elif len(sys.argv) > 1:
+        supervisor = connect_wiimote(sys.argv[1])
 
-    paint = Painter(wiimote, wiidraw)
+    paint = Painter(supervisor)
     sys.exit(app.exec_())
 
 
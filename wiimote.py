@@ -33,71 +33,246 @@
 
 # based on the awesome documentation at http://wiibrew.org/wiki/Wiimote
 
-import bluetooth
+import asyncio
+import bisect
+import collections
+import concurrent.futures
+import contextlib
+import errno
+import functools
+import heapq
+import json
+import os
+import select
+import struct
 import threading
 import time
+import traceback
+import numpy as np
 
 # ################### nanosleep ########################### #
 # from https://github.com/graycatlabs/PyBBIO/blob/master/tests/sleep_test.py
-import ctypes
-libc = ctypes.CDLL('libc.so.6')  # required for precise timing of speaker output
+# libc is loaded on the first call of nsleep(), not on import
+_nanosleep = None
+_nanosleep_req = None
+_nanosleep_rem = None
+_load_lock = threading.Lock()  # libc and PyBluez are loaded by the first thread that needs them
 
 
-class Timespec(ctypes.Structure):
-    """ timespec struct for nanosleep, see:
-    http://linux.die.net/man/2/nanosleep """
-    _fields_ = [('tv_sec', ctypes.c_long),
-                ('tv_nsec', ctypes.c_long)]
+def _load_nanosleep():
+    global _nanosleep, _nanosleep_req, _nanosleep_rem
+    import ctypes
 
-libc.nanosleep.argtypes = [ctypes.POINTER(Timespec),
-                           ctypes.POINTER(Timespec)]
-nanosleep_req = Timespec()
-nanosleep_rem = Timespec()
+    class Timespec(ctypes.Structure):
+        """ timespec struct for nanosleep, see:
+        http://linux.die.net/man/2/nanosleep """
+        _fields_ = [('tv_sec', ctypes.c_long),
+                    ('tv_nsec', ctypes.c_long)]
+
+    libc = ctypes.CDLL('libc.so.6')  # required for precise timing of speaker output
+    libc.nanosleep.argtypes = [ctypes.POINTER(Timespec),
+                               ctypes.POINTER(Timespec)]
+    _nanosleep_req = Timespec()
+    _nanosleep_rem = Timespec()
+    _nanosleep = libc.nanosleep
 
 
 def nsleep(us):
     """ Delay microseconds with libc nanosleep() using ctypes. """
+    if _nanosleep is None:
+        with _load_lock:
+            if _nanosleep is None:
+                _load_nanosleep()
     if (us >= 1000000):
-        sec = us/1000000
+        sec = int(us // 1000000)
         us %= 1000000
     else:
         sec = 0
-    nanosleep_req.tv_sec = sec
-    nanosleep_req.tv_nsec = int(us * 1000)
-    libc.nanosleep(nanosleep_req, nanosleep_rem)
+    _nanosleep_req.tv_sec = sec
+    _nanosleep_req.tv_nsec = int(us * 1000)
+    _nanosleep(_nanosleep_req, _nanosleep_rem)
 
 # ########################################################### #
 
 VERSION = (0, 4)
+bluetooth = None  # PyBluez, see _bluetooth()
 DEBUG = False
 KNOWN_DEVICES = ['Nintendo RVL-CNT-01', 'Nintendo RVL-CNT-01-TR']
-
-
-def find():
+DEVICE_CACHE_PATH = os.path.join(os.path.expanduser('~'), '.wiimote_devices.json')
+LOOKUP_TIMEOUT = 5.0  # seconds for a Bluetooth name request
+
+IR_BASIC = 10     # two pairs of IR objects in 5 bytes each
+IR_EXTENDED = 12  # four IR objects in 3 bytes each
+
+# Layout of all input reports, see http://wiibrew.org/wiki/Wiimote#Data_Reporting
+# report ID: (button offset, accelerometer offset, IR offset, IR format)
+# Offsets are counted from the report ID byte, None means that the data is not
+# contained in the report. Used to build the decoder dispatch table.
+REPORT_LAYOUTS = {
+    0x20: (1, None, None, None),  # status information
+    0x21: (1, None, None, None),  # memory read data
+    0x22: (1, None, None, None),  # output report acknowledgement
+    0x30: (1, None, None, None),
+    0x31: (1, 3, None, None),
+    0x32: (1, None, None, None),  # + 8 extension bytes
+    0x33: (1, 3, 6, IR_EXTENDED),
+    0x34: (1, None, None, None),  # + 19 extension bytes
+    0x35: (1, 3, None, None),     # + 16 extension bytes
+    0x36: (1, None, 3, IR_BASIC),  # + 9 extension bytes
+    0x37: (1, 3, 6, IR_BASIC),    # + 6 extension bytes
+    0x3d: (None, None, None, None),  # 21 extension bytes
+    0x3e: (1, None, None, None),  # interleaved, not supported
+    0x3f: (1, None, None, None),  # interleaved, not supported
+}
+
+# Result of decode_reports(): one record per 0x33 report
+IR_OBJECT_DTYPE = np.dtype([('x', np.uint16), ('y', np.uint16), ('size', np.uint8)])
+REPORT_DTYPE = np.dtype([('buttons', np.uint16),
+                         ('acc', np.uint16, (3,)),
+                         ('ir', IR_OBJECT_DTYPE, (4,))])
+
+# State of the IRCam: one row (id, x, y, size) per visible IR object, the first `count` rows are valid.
+# `seq` numbers the IR reports (frames) starting at 1, `time` is the time.monotonic() of reception.
+IR_STATE_DTYPE = np.dtype([('objects', np.int16, (4, 4)), ('count', np.int16),
+                           ('seq', np.int64), ('time', np.float64)])
+
+# Records of a SampleBuffer: one per received data report (0x30-0x3f).
+# Fields whose data is not contained in the report are zero.
+SAMPLE_DTYPE = np.dtype([('time', np.float64),  # time.monotonic() on reception
+                         ('seq', np.uint64),
+                         ('controller', np.uint8),  # WiiMote.controller_id
+                         ('report', np.uint8),
+                         ('buttons', np.uint16),
+                         ('acc', np.uint16, (3,)),
+                         ('ir', IR_OBJECT_DTYPE, (4,))])
+
+
+def find(duration=8, timeout=LOOKUP_TIMEOUT, cache=True):
     """
-    Uses Bluetooth SDP to find available Wiimotes.
+    Searches for Wiimotes for about `duration` seconds (Bluetooth inquiry) and
+    requests the names of all found devices in parallel, waiting at most `timeout`
+    seconds for the answers.
     Returns a list of (bt_addr, device_name) tuples.
-    Only supported Wiimote devices are returned.
+    Only supported Wiimote devices are returned. They are added to the device
+    cache (see DeviceCache) unless `cache` is False.
     """
-    devices = bluetooth.find_service()
-    wiimotes = []
-    for device in devices:
-        if device["name"] in KNOWN_DEVICES:
-            wiimotes.append((device["host"], device["name"]))
+    addresses = _bluetooth().discover_devices(duration=max(1, int(round(duration / 1.28))),
+                                              lookup_names=False)
+    names = _lookup_names(addresses, timeout)
+    wiimotes = [(addr, name) for addr, name in zip(addresses, names) if name in KNOWN_DEVICES]
+    if cache:
+        device_cache = DeviceCache.default()
+        for addr, name in wiimotes:
+            device_cache.update(addr, name)
     return wiimotes
 
 
-def connect(btaddr, model=None):
+def connect(btaddr, model=None, cache=True):
     """
     Establishes a connection to the Wiimote at *btaddr* and returns a Wiimote
-    object. If no *model* is specified, the model is determined automatically.
+    object. If no *model* is specified, the model is taken from the device cache
+    or determined automatically (which takes a few seconds).
+    The time from calling connect() to the first report is available as
+    `startup_time()` of the returned object.
     """
-    if model is None:
-        model = bluetooth.lookup_name(btaddr)
-    if model in KNOWN_DEVICES:
-        return WiiMote(btaddr, model)
-    else:
-        raise Exception("Wiimote model '%s' unknown!" % (model))
+    started = time.monotonic()
+    model = _lookup_model(btaddr, model, cache)
+    wm = WiiMote(btaddr, model)
+    wm._connect_started = started
+    if cache:
+        DeviceCache.default().update(btaddr, model)
+    return wm
+
+
+@contextlib.asynccontextmanager
+async def connect_async(btaddr, model=None):
+    """
+    asyncio variant of connect(), to be used as `async with connect_async(btaddr) as wm:`.
+    Instead of starting a receive thread, the data socket is watched by the running
+    event loop (loop.add_reader()), so reports are decoded and callbacks are called
+    on the event loop. Use `wm.reports()` and `wm.memory.read_async()` from coroutines.
+    The connection is closed when the block is left.
+    """
+    loop = asyncio.get_running_loop()
+    started = time.monotonic()
+    model = await loop.run_in_executor(None, _lookup_model, btaddr, model)
+    # connecting the sockets blocks for a while
+    wm = await loop.run_in_executor(None, functools.partial(WiiMote, btaddr, model, threaded=False))
+    wm._connect_started = started
+    DeviceCache.default().update(btaddr, model)
+    wm._com.attach_loop(loop)
+    try:
+        yield wm
+    finally:
+        wm._com._detach_loop()
+
+
+def decode_reports(reports):
+    """
+    Decodes a batch of captured 0x33 reports (buttons, accelerometer and extended IR data)
+    at once, e.g. for offline analysis of recorded sessions.
+    `reports` is an (N, M) uint8 array with one raw data socket read per row
+    (0xa1 transaction header, report ID, payload, zero-padded). The 0x33 report
+    ends with column 19, longer rows (e.g. the 23 bytes of a capture record) are fine.
+    Returns a structured array of `REPORT_DTYPE` with N records. IR slots without
+    an object (sent as 0xff bytes) have size 0. Uses the same bit layout as the live decoders.
+    """
+    reports = np.asarray(reports, dtype=np.uint8)
+    if reports.ndim != 2 or reports.shape[1] < 19:
+        raise ValueError("reports need to be an (N, M) array with M >= 19")
+    if np.any(reports[:, 1] != 0x33):
+        raise ValueError("only reports of type 0x33 can be decoded")
+    rpt = reports[:, 1:19].astype(np.uint16)  # strip transaction header like CommunicationHandler._handle
+    decoded = np.zeros(len(rpt), dtype=REPORT_DTYPE)
+    btn_1, btn_2 = rpt[:, 1], rpt[:, 2]
+    decoded['buttons'] = ((btn_1 << 8) | btn_2) & Buttons._ALL_BUTTONS
+    acc = decoded['acc']
+    acc[:, 0] = (rpt[:, 3] << 2) + ((btn_1 & 0b01100000) >> 5)
+    acc[:, 1] = (rpt[:, 4] << 2) + ((btn_2 & 0b00100000) >> 4)
+    acc[:, 2] = (rpt[:, 5] << 2) + ((btn_2 & 0b01000000) >> 5)
+    ir_data = rpt[:, 6:18].reshape(-1, 4, 3)
+    rest = ir_data[:, :, 2]
+    ir = decoded['ir']
+    ir['x'] = ir_data[:, :, 0] + ((rest & 0b00110000) << 4)
+    ir['y'] = ir_data[:, :, 1] + ((rest & 0b11000000) << 2)
+    ir['size'] = np.where((ir_data == 0xff).all(axis=2), 0, rest & 0b00001111)
+    return decoded
+
+
+def export_stats(wiimotes, prefix='wiimote'):
+    """
+    Formats the stats() of all `wiimotes` in the Prometheus text format, e.g. to be
+    served on a /metrics endpoint for a dashboard. Each metric is labelled with the controller id.
+    """
+    lines = []
+
+    def add(name, value, **labels):
+        labels = ','.join('%s="%s"' % item for item in sorted(labels.items()))
+        lines.append('%s_%s{%s} %r' % (prefix, name, labels, float(value)))
+
+    for wm in wiimotes:
+        stats = wm.stats()
+        cid = stats['controller']
+        reports = stats['reports']
+        if reports is not None:
+            for rpt, count in reports['report_types'].items():
+                add('reports_total', count, controller=cid, report=rpt)
+            for key in ['rate', 'current_rate', 'jitter', 'gaps', 'missed_reports',
+                        'decode_time_mean', 'decode_time_max']:
+                add(key, reports[key], controller=cid)
+            cumulative = 0
+            for upper, count in reports['interval_histogram'].items():
+                cumulative += count
+                add('interval_seconds_bucket', cumulative, controller=cid, le=upper)
+        if stats['startup_time'] is not None:
+            add('startup_seconds', stats['startup_time'], controller=cid)
+        add('command_queue_depth', stats['queues']['commands'], controller=cid)
+        for sensor, subscriptions in sorted(stats['callbacks'].items()):
+            for i, sub in enumerate(subscriptions):
+                for key in ['depth', 'max_depth', 'delivered', 'dropped', 'call_time_mean', 'call_time_max']:
+                    if key in sub:
+                        add('callback_' + key, sub[key], controller=cid, sensor=sensor, callback=i)
+    return '\n'.join(lines) + '\n'
 
 
 def _val_to_byte_list(number, num_bytes, big_endian=True):
@@ -143,6 +318,33 @@ def _add_padding(byte_list, intended_length, padding_byte=0x00):
     return byte_list
 
 
+def _all_of(futures):
+    """
+    Returns a Future that is resolved when all `futures` are done, or fails with
+    the first exception raised by one of them.
+    """
+    combined = concurrent.futures.Future()
+    remaining = [len(futures)]
+    lock = threading.Lock()
+
+    def on_done(future):
+        with lock:
+            if combined.done():
+                return
+            if future.exception() is not None:
+                combined.set_exception(future.exception())
+                return
+            remaining[0] -= 1
+            if remaining[0] == 0:
+                combined.set_result(None)
+
+    if not futures:
+        combined.set_result(None)
+    for future in futures:
+        future.add_done_callback(on_done)
+    return combined
+
+
 def _debug(msg):
     """
     Internal debugging function, prints out parameters on stdout
@@ -152,12 +354,393 @@ def _debug(msg):
         print("DEBUG: " + str(msg))
 
 
+def _bluetooth():
+    """
+    Imports PyBluez on first use. Decoding, captures and simulated devices
+    work without it.
+    """
+    global bluetooth
+    if bluetooth is None:
+        with _load_lock:
+            if bluetooth is None:
+                try:
+                    import bluetooth as pybluez
+                except ImportError as e:
+                    raise ImportError("PyBluez is required to connect to a Wiimote") from e
+                bluetooth = pybluez
+    return bluetooth
+
+
+def _lookup_names(addresses, timeout=LOOKUP_TIMEOUT):
+    """
+    Requests the names of all devices at `addresses` in parallel.
+    Returns the list of names, None for devices that did not answer within `timeout` seconds.
+    """
+    if not addresses:
+        return []
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=len(addresses))
+    futures = [executor.submit(_bluetooth().lookup_name, addr, timeout=timeout) for addr in addresses]
+    concurrent.futures.wait(futures, timeout=timeout + 1)
+    executor.shutdown(wait=False)
+    return [future.result() if future.done() and not future.exception() else None
+            for future in futures]
+
+
+def _lookup_model(btaddr, model=None, cache=True):
+    """
+    Returns the model of the Wiimote at `btaddr`: `model` if given, else the cached model
+    or the Bluetooth device name. Raises an Exception if it is not a known Wiimote model.
+    """
+    if model is None and cache:
+        model = DeviceCache.default().get(btaddr)
+    if model is None:
+        model = _bluetooth().lookup_name(btaddr, timeout=LOOKUP_TIMEOUT)
+    if model not in KNOWN_DEVICES:
+        raise Exception("Wiimote model '%s' unknown!" % (model))
+    return model
+
+
+def _unregister(subscriptions, func):
+    """
+    Closes and removes the Subscription of `func` from the list `subscriptions`.
+    """
+    for subscription in subscriptions:
+        if subscription.func == func:
+            subscription.close()
+            subscriptions.remove(subscription)
+            return
+
+
+class DeviceCache(object):
+    """
+    Remembers the model and the time of the last connection of every Wiimote
+    in a JSON file, so that reconnecting does not need a Bluetooth name request.
+    """
+
+    _default = None
+
+    def __init__(self, path=None):
+        self.path = path or DEVICE_CACHE_PATH
+        self._lock = threading.Lock()
+        self._devices = {}  # address -> {'model': ..., 'last_seen': time.time()}
+        try:
+            with open(self.path) as f:
+                self._devices = json.load(f)
+        except (OSError, ValueError):
+            pass  # no cache yet or unreadable, start over
+
+    @classmethod
+    def default(cls):
+        """
+        Returns the cache at DEVICE_CACHE_PATH used by find() and connect().
+        """
+        if cls._default is None:
+            cls._default = cls()
+        return cls._default
+
+    def get(self, btaddr):
+        """
+        Returns the cached model of the Wiimote at `btaddr` or None.
+        """
+        entry = self._devices.get(btaddr.upper())
+        return entry['model'] if entry else None
+
+    def devices(self):
+        """
+        Returns a list of (bt_addr, model) tuples, most recently seen first.
+        """
+        entries = sorted(self._devices.items(), key=lambda item: item[1]['last_seen'], reverse=True)
+        return [(addr, entry['model']) for addr, entry in entries]
+
+    def update(self, btaddr, model):
+        with self._lock:
+            self._devices[btaddr.upper()] = {'model': model, 'last_seen': time.time()}
+            self._save()
+
+    def forget(self, btaddr):
+        with self._lock:
+            if self._devices.pop(btaddr.upper(), None) is not None:
+                self._save()
+
+    def _save(self):
+        tmp_path = self.path + '.tmp'
+        try:
+            with open(tmp_path, 'w') as f:
+                json.dump(self._devices, f, indent=1)
+            os.replace(tmp_path, self.path)  # never leaves a half-written cache
+        except OSError as e:
+            _debug("could not save device cache: " + str(e))
+
+
+class Subscription(object):
+    """
+    A callback function registered with a sensor of the Wiimote.
+    Events are put into a queue and the callback is called from a worker
+    thread of its own, so slow callbacks do not stall the receive thread.
+    The queueing `policy` determines what happens if the callback can not keep up:
+    DELIVER_ALL: all events are queued and delivered, the queue is not bounded
+    (a slow callback lags behind, see `depth`).
+    COALESCE_LATEST: only the most recent event is kept, older ones are replaced.
+    DROP_OLDEST: at most `maxlen` events are queued, the oldest one is dropped if the queue is full.
+    DROP_NEWEST: at most `maxlen` events are queued, new events are dropped while the queue is full.
+    INLINE: no queue, the callback is called directly on the receive thread.
+    The worker thread is stopped by close(), which the WiiMote calls for all its
+    subscriptions when the connection is closed, and restarted by reopen().
+    """
+
+    DELIVER_ALL = 'all'
+    COALESCE_LATEST = 'latest'
+    DROP_OLDEST = 'drop_oldest'
+    DROP_NEWEST = 'drop_newest'
+    INLINE = 'inline'
+
+    POLICIES = [DELIVER_ALL, COALESCE_LATEST, DROP_OLDEST, DROP_NEWEST, INLINE]
+
+    MAXLEN = 64
+
+    def __init__(self, func, policy=DELIVER_ALL, maxlen=MAXLEN, timed=False):
+        """
+        `maxlen` bounds the queue of the DROP_OLDEST and DROP_NEWEST policies.
+        If `timed` is True, the execution time of the callback is measured (see stats()).
+        """
+        if policy not in self.POLICIES:
+            raise ValueError("unknown policy '%s'" % policy)
+        self.func = func
+        self.policy = policy
+        self.maxlen = {self.COALESCE_LATEST: 1, self.DELIVER_ALL: None}.get(policy, maxlen)
+        self.delivered = 0
+        self.dropped = 0
+        self.max_depth = 0
+        self.timed = timed
+        self.call_time = 0.0  # total and longest execution time of timed calls
+        self.max_call_time = 0.0
+        self._timed_calls = 0
+        self._queue = collections.deque()
+        self._cond = threading.Condition()
+        self._closed = False
+        self._running = False  # worker thread
+        if policy != self.INLINE:
+            self._start()
+
+    def __repr__(self):
+        return "Subscription(%r, %s, depth=%d, dropped=%d)" % (self.func, self.policy, self.depth, self.dropped)
+
+    @property
+    def depth(self):
+        """
+        Number of events waiting in the queue.
+        """
+        return len(self._queue)
+
+    def stats(self):
+        stats = {'policy': self.policy, 'depth': self.depth, 'max_depth': self.max_depth,
+                 'maxlen': self.maxlen, 'delivered': self.delivered, 'dropped': self.dropped}
+        if self._timed_calls:
+            stats['call_time_mean'] = self.call_time / self._timed_calls
+            stats['call_time_max'] = self.max_call_time
+        return stats
+
+    def post(self, *args):
+        """
+        Queues an event, i.e. the arguments for one call of the callback function.
+        Events posted after close() are discarded.
+        """
+        if self.policy == self.INLINE:
+            if not self._closed:
+                self._call(args)
+                self.delivered += 1
+            return
+        with self._cond:
+            if self._closed:
+                return
+            queue = self._queue
+            if self.maxlen is not None and len(queue) >= self.maxlen:
+                self.dropped += 1
+                if self.policy == self.DROP_NEWEST:
+                    return
+                queue.popleft()
+            queue.append(args)
+            if len(queue) > self.max_depth:
+                self.max_depth = len(queue)
+            self._cond.notify()
+
+    def _call(self, args):
+        if not self.timed:
+            self.func(*args)
+            return
+        start = time.perf_counter()
+        try:
+            self.func(*args)
+        finally:
+            elapsed = time.perf_counter() - start
+            self.call_time += elapsed
+            self._timed_calls += 1
+            if elapsed > self.max_call_time:
+                self.max_call_time = elapsed
+
+    def close(self):
+        """
+        Stops the worker thread after the queued events have been delivered.
+        """
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+
+    def reopen(self):
+        """
+        Delivers events again after close(), e.g. when the Wiimote has been reconnected.
+        """
+        with self._cond:
+            self._closed = False
+            if self.policy != self.INLINE and not self._running:
+                self._start()  # else the old worker is still draining the queue
+
+    def _start(self):
+        self._running = True
+        threading.Thread(target=self._run, daemon=True).start()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._queue and not self._closed:
+                    self._cond.wait()
+                if not self._queue:
+                    self._running = False
+                    return
+                args = self._queue.popleft()
+            try:
+                self._call(args)
+            except Exception:
+                traceback.print_exc()
+            self.delivered += 1
+
+
+class ScheduledEvent(object):
+    """
+    A function call that is due at `when` (time.monotonic()), see Scheduler.schedule().
+    """
+
+    __slots__ = ['when', 'func', 'args', 'key', 'cancelled', '_scheduler']
+
+    def __init__(self, scheduler, when, func, args, key):
+        self._scheduler = scheduler
+        self.when = when
+        self.func = func
+        self.args = args
+        self.key = key
+        self.cancelled = False
+
+    def cancel(self):
+        """
+        Prevents the call if it has not happened yet.
+        """
+        self._scheduler._cancel(self)
+
+
+class Scheduler(threading.Thread):
+    """
+    Calls functions at given times from a single thread, e.g. to switch off the rumble
+    motor, to step LED animations or to play speaker cues, instead of a thread or Timer per event.
+    Pending events are kept in a heap ordered by their due time. An event scheduled with
+    the `key` of a pending event replaces it, so that overlapping events coalesce.
+    The functions should return quickly as they delay all later events.
+    """
+
+    _default = None
+    _default_lock = threading.Lock()
+
+    def __init__(self):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self._heap = []  # (when, sequence number, ScheduledEvent)
+        self._keyed = {}  # key -> pending ScheduledEvent
+        self._counter = 0
+        self._cond = threading.Condition()
+        self.executed = 0
+
+    @classmethod
+    def default(cls):
+        """
+        Returns the scheduler shared by all Wiimotes.
+        """
+        with cls._default_lock:
+            if cls._default is None:
+                cls._default = cls()
+                cls._default.start()
+        return cls._default
+
+    def schedule(self, delay, func, *args, key=None):
+        """
+        Calls `func(*args)` in `delay` seconds. Returns the ScheduledEvent, which can be cancelled.
+        A pending event with the same `key` is cancelled.
+        """
+        with self._cond:
+            event = ScheduledEvent(self, time.monotonic() + delay, func, args, key)
+            if key is not None:
+                pending = self._keyed.pop(key, None)
+                if pending is not None:
+                    pending.cancelled = True
+                self._keyed[key] = event
+            self._counter += 1
+            heapq.heappush(self._heap, (event.when, self._counter, event))
+            if self._heap[0][2] is event:
+                self._cond.notify()  # due before the event the thread is waiting for
+        return event
+
+    def pending(self, key):
+        """
+        Returns the pending event with `key` or None.
+        """
+        return self._keyed.get(key)
+
+    def cancel(self, key):
+        """
+        Cancels the pending event with `key`, if there is one.
+        """
+        with self._cond:
+            event = self._keyed.pop(key, None)
+            if event is not None:
+                event.cancelled = True
+
+    def _cancel(self, event):
+        with self._cond:
+            event.cancelled = True
+            if event.key is not None and self._keyed.get(event.key) is event:
+                del self._keyed[event.key]
+
+    def run(self):
+        heap = self._heap
+        while True:
+            with self._cond:
+                while True:
+                    while heap and heap[0][2].cancelled:
+                        heapq.heappop(heap)
+                    if not heap:
+                        self._cond.wait()
+                        continue
+                    delay = heap[0][0] - time.monotonic()
+                    if delay <= 0:
+                        break
+                    self._cond.wait(delay)
+                event = heapq.heappop(heap)[2]
+                if event.key is not None and self._keyed.get(event.key) is event:
+                    del self._keyed[event.key]
+            try:
+                event.func(*event.args)
+            except Exception:
+                traceback.print_exc()
+            self.executed += 1
+
+
 class Accelerometer(object):
     """
     Represents the accelerometer of the Wiimote.
     """
 
-    SUPPORTED_REPORTS = [0x31, 0x33]
+    SUPPORTED_REPORTS = [0x31, 0x33, 0x35, 0x37]
+
+    # button bytes (which hold the LSBs of the axes) and the MSBs of X, Y and Z
+    _FORMAT = struct.Struct('>BBBBB')
 
     def __init__(self, wiimote):
         self._state = [0.0, 0.0, 0.0]
@@ -177,29 +760,33 @@ class Accelerometer(object):
         else:
             raise IndexError("list index %d out of range" % (axis))
 
-    def register_callback(self, func):
+    def register_callback(self, func, policy=Subscription.DELIVER_ALL, maxlen=Subscription.MAXLEN):
         """
         Register a callback function `func` that gets called every time
         when new accelerometer values are transmitted from the Wiimote.
         A list with XYZ accelerometer values between 0 and 1023 is passed
         to the callback function.
+        See `Subscription` for the queueing `policy`, the Subscription is returned.
         """
-        self._callbacks.append(func)
+        subscription = Subscription(func, policy, maxlen, timed=self._com.stats is not None)
+        self._callbacks.append(subscription)
+        return subscription
 
     def unregister_callback(self, func):
         """
         Unregister a callback function `func` that has been previously registered.
         The function will no longer get called on new accelerometer data from the Wiimote.
         """
-        if func in self._callbacks:
-            self._callbacks.remove(func)
+        _unregister(self._callbacks, func)
 
     def _notify_callbacks(self):
         """
         Call all registered callback functions with state (x,y,z values) as parameter.
         """
-        for callback in self._callbacks:
-            callback(self._state)
+        if self._callbacks:
+            state = list(self._state)  # the state list is updated in place
+            for subscription in self._callbacks:
+                subscription.post(state)
 
     def handle_report(self, report):
         """
@@ -208,17 +795,35 @@ class Accelerometer(object):
         """
         if report[0] in [0x3e, 0x3f]:  # interleaved modes
             raise NotImplementedError("Data reporting mode 0x3e/0x3f not supported")
-        x_msb, y_msb, z_msb = report[3:6]
-        x = (x_msb << 2) + ((report[1] & 0b01100000) >> 5)
-        y = (y_msb << 2) + ((report[2] & 0b00100000) >> 4)
-        z = (z_msb << 2) + ((report[2] & 0b01000000) >> 5)
-        self._state = [x, y, z]
+        self._decode(report, REPORT_LAYOUTS[report[0]][1])
+
+    def _decode(self, report, offset=3):
+        """
+        Decodes the accelerometer data at `offset` of `report` (a bytes-like object
+        or memoryview starting with the report ID) into the state list.
+        """
+        btn_1, btn_2, x_msb, y_msb, z_msb = self._FORMAT.unpack_from(report, offset - 2)
+        state = self._state
+        state[0] = (x_msb << 2) + ((btn_1 & 0b01100000) >> 5)
+        state[1] = (y_msb << 2) + ((btn_2 & 0b00100000) >> 4)
+        state[2] = (z_msb << 2) + ((btn_2 & 0b01000000) >> 5)
         self._notify_callbacks()
 
 
+# Passed to button callbacks. The first two fields are the button name and its new state
+# (pressed or not), `time` is the time.monotonic() timestamp of the event and `press_time`
+# the timestamp of the press that started it (release time - press time = duration).
+ButtonEvent = collections.namedtuple('ButtonEvent', ['button', 'pressed', 'kind', 'time', 'press_time'])
+
+
 class Buttons(object):
     """
     Represents the buttons of the Wiimote.
+    The button state is kept as a 16-bit mask. Changes are detected with a single XOR
+    per report and reported as ButtonEvents of kind PRESS, RELEASE, HOLD (button pressed
+    for HOLD_TIME seconds) or DOUBLE_CLICK (second press within DOUBLE_CLICK_TIME seconds).
+    Holds are detected when the next report arrives after HOLD_TIME.
+    Callbacks only get PRESS and RELEASE events unless they ask for other `kinds`.
     """
 
     BUTTONS = {'A': 0x0008,
@@ -233,13 +838,30 @@ class Buttons(object):
                'Two': 0x0001,
                'Up': 0x0800, }
 
+    PRESS = 'press'
+    RELEASE = 'release'
+    HOLD = 'hold'
+    DOUBLE_CLICK = 'double_click'
+    KINDS = (PRESS, RELEASE, HOLD, DOUBLE_CLICK)
+
+    HOLD_TIME = 0.5
+    DOUBLE_CLICK_TIME = 0.3
+
+    _ALL_BUTTONS = 0x1f9f  # all bits of the button bytes that belong to a button
+    _FORMAT = struct.Struct('>H')
+
     def __init__(self, wiimote):
         self._wiimote = wiimote
         self._com = wiimote._com
         self._state = {}
         for button in list(Buttons.BUTTONS.keys()):
             self._state[button] = False
+        self._mask = 0x0000
+        self._hold_pending = 0x0000  # pressed buttons that have not been reported as held yet
+        self._press_time = {}
+        self._last_press_time = {}  # for double click detection
         self._callbacks = []
+        self._kinds = {}  # Subscription -> event kinds passed to it
 
     def __len__(self):
         return len(self._state)
@@ -253,49 +875,85 @@ class Buttons(object):
         else:
             raise KeyError(str(btn))
 
-    def register_callback(self, func):
+    def register_callback(self, func, policy=Subscription.DELIVER_ALL, maxlen=Subscription.MAXLEN,
+                          kinds=(PRESS, RELEASE)):
         """
         Register a callback function `func` that gets called every time
-        when new button states are transmitted from the Wiimote.
-        A list of all _changed_ buttons is passed as parameter to this function.
+        the state of a button changes. A list of ButtonEvents is passed as parameter
+        to this function. `kinds` selects the events, e.g. Buttons.KINDS to also get
+        holds and double clicks (the default, presses and releases, keeps the pressed
+        states alternating as in the (button, state) pairs of older versions).
+        See `Subscription` for the queueing `policy`, the Subscription is returned.
         """
-        self._callbacks.append(func)
+        subscription = Subscription(func, policy, maxlen, timed=self._com.stats is not None)
+        self._kinds[subscription] = frozenset(kinds)
+        self._callbacks.append(subscription)
+        return subscription
 
     def unregister_callback(self, func):
         """
         Unregister a callback function `func` that has been previously registered.
         The function will no longer get called on changed button states.
         """
-        if func in self._callbacks:
-            self._callbacks.remove(func)
+        _unregister(self._callbacks, func)
+        self._kinds = {subscription: self._kinds[subscription] for subscription in self._callbacks}
 
-    def _notify_callbacks(self, diff):
+    def _notify_callbacks(self, events):
         """
-        Call all registered callback functions with a list of buttons whose state
-        has changed as parameter.
+        Call all registered callback functions with a list of ButtonEvents as parameter.
         """
-        for callback in self._callbacks:
-            callback(diff)
+        for subscription in self._callbacks:
+            kinds = self._kinds[subscription]
+            selected = [event for event in events if event.kind in kinds]
+            if selected:
+                subscription.post(selected)
 
     def handle_report(self, report):
         """
         Extract button data from a Wiimote report.
         Usually gets called by the Wiimote CommunicationHandler object.
         """
-        btn_bytes = (report[1] << 8) + report[2]
-        new_state = {}
-        for btn, mask in list(Buttons.BUTTONS.items()):
-            new_state[btn] = bool(mask & btn_bytes)
-        diff = self._update_state(new_state)
-        self._notify_callbacks(diff)
+        self._decode(report, REPORT_LAYOUTS[report[0]][0])
 
-    def _update_state(self, new_state):
-        diff = []
-        for btn, state in list(new_state.items()):
-            if self._state[btn] != state:
-                diff.append((btn, state))
-                self._state[btn] = state
-        return diff
+    def _decode(self, report, offset=1):
+        """
+        Decodes the two button bytes at `offset` of `report` (a bytes-like object
+        or memoryview starting with the report ID).
+        """
+        btn_bytes = self._FORMAT.unpack_from(report, offset)[0] & Buttons._ALL_BUTTONS
+        changed = btn_bytes ^ self._mask
+        if not (changed or self._hold_pending):
+            return
+        now = time.monotonic()
+        events = []
+        if changed:
+            self._mask = btn_bytes
+            self._hold_pending &= btn_bytes
+            for btn, mask in Buttons.BUTTONS.items():
+                if changed & mask:
+                    self._update_state(btn, mask, bool(btn_bytes & mask), now, events)
+        if self._hold_pending:
+            for btn, mask in Buttons.BUTTONS.items():
+                if self._hold_pending & mask and now - self._press_time[btn] >= self.HOLD_TIME:
+                    self._hold_pending &= ~mask
+                    events.append(ButtonEvent(btn, True, Buttons.HOLD, now, self._press_time[btn]))
+        if events:
+            self._notify_callbacks(events)
+
+    def _update_state(self, btn, mask, pressed, now, events):
+        self._state[btn] = pressed
+        if pressed:
+            self._press_time[btn] = now
+            self._hold_pending |= mask
+            events.append(ButtonEvent(btn, True, Buttons.PRESS, now, now))
+            last_press = self._last_press_time.get(btn)
+            if last_press is not None and now - last_press < self.DOUBLE_CLICK_TIME:
+                events.append(ButtonEvent(btn, True, Buttons.DOUBLE_CLICK, now, now))
+                self._last_press_time[btn] = None  # a third press does not count as double click again
+            else:
+                self._last_press_time[btn] = now
+        else:
+            events.append(ButtonEvent(btn, False, Buttons.RELEASE, now, self._press_time.get(btn, now)))
 
 
 class LEDs(object):
@@ -341,6 +999,26 @@ class LEDs(object):
                 led_byte += val
         self._com._send(RPT_LED, led_byte)
 
+    def animate(self, patterns, interval=0.1, repeat=1):
+        """
+        Shows the LED states in `patterns` (lists of four boolean values) one after the other,
+        each for `interval` seconds, `repeat` times (0: until stop_animation() is called).
+        Returns immediately, the animation is stepped by the Scheduler.
+        A new animation replaces one that is still running. The last pattern stays on.
+        """
+        Scheduler.default().schedule(0, self._animation_step, list(patterns), interval, repeat, 0,
+                                     key=(self, 'animation'))
+
+    def stop_animation(self):
+        Scheduler.default().cancel((self, 'animation'))
+
+    def _animation_step(self, patterns, interval, repeat, step):
+        self.set_leds(patterns[step % len(patterns)])
+        step += 1
+        if repeat == 0 or step < repeat * len(patterns):
+            Scheduler.default().schedule(interval, self._animation_step, patterns, interval, repeat, step,
+                                         key=(self, 'animation'))
+
 
 class Rumbler(object):
     """
@@ -361,62 +1039,264 @@ class Rumbler(object):
     def rumble(self, length=0.5):
         """
         Activate the rumble motor for `length` seconds.
+        Overlapping calls coalesce: the motor stops when the last pulse has ended.
         """
-        t = threading.Timer(length, self.set_rumble, [False])
-        t.start()
-        self.set_rumble(True)
+        scheduler = Scheduler.default()
+        pending = scheduler.pending((self, 'off'))
+        end = time.monotonic() + length
+        if pending is not None and pending.when > end:
+            return  # already rumbling for long enough
+        scheduler.schedule(length, self.set_rumble, False, key=(self, 'off'))
+        if not self._state:
+            self.set_rumble(True)
+
+    def pulse(self, count, length=0.1, pause=0.1):
+        """
+        Rumbles `count` times for `length` seconds each, with `pause` seconds in between.
+        Replaces a pulse train that is still running.
+        """
+        Scheduler.default().schedule(0, self._pulse, count, length, pause, key=(self, 'pulse'))
+
+    def _pulse(self, count, length, pause):
+        self.rumble(length)
+        if count > 1:
+            Scheduler.default().schedule(length + pause, self._pulse, count - 1, length, pause,
+                                         key=(self, 'pulse'))
+
+
+class Sound(object):
+    """
+    A sound encoded for the Wiimote speaker: the payloads of all speaker data reports
+    (0x18), computed once so that playing the sound only needs to send them.
+    `format` is Speaker.FORMAT_PCM8 (8-bit signed PCM, 20 samples per report)
+    or Speaker.FORMAT_ADPCM (4-bit Yamaha ADPCM, 40 samples per report).
+    """
+
+    # Yamaha ADPCM step tables, see http://wiibrew.org/wiki/Wiimote#Speaker
+    _ADPCM_DIFF = [1, 3, 5, 7, 9, 11, 13, 15, -1, -3, -5, -7, -9, -11, -13, -15]
+    _ADPCM_SCALE = [230, 230, 230, 230, 307, 409, 512, 614] * 2
+
+    def __init__(self, packets, format, rate):
+        self.packets = packets
+        self.format = format
+        self.rate = rate
+        samples_per_packet = Speaker.PACKET_SIZE * (2 if format == Speaker.FORMAT_ADPCM else 1)
+        self.packet_duration = samples_per_packet / rate
+
+    def __len__(self):
+        return len(self.packets)
+
+    @property
+    def duration(self):
+        return len(self.packets) * self.packet_duration
+
+    @classmethod
+    def from_samples(cls, samples, rate, format=None):
+        """
+        Encodes `samples` (floats between -1 and 1) that are played at `rate` Hz.
+        """
+        if format is None:
+            format = Speaker.FORMAT_PCM8
+        samples = np.clip(np.asarray(samples, dtype=np.float64), -1.0, 1.0)
+        if format == Speaker.FORMAT_PCM8:
+            data = (np.round(samples * 127).astype(np.int8)).view(np.uint8).tolist()
+        elif format == Speaker.FORMAT_ADPCM:
+            data = cls._encode_adpcm(np.round(samples * 32767).astype(np.int32).tolist())
+        else:
+            raise ValueError("unknown speaker format %x" % format)
+        packets = []
+        for offset in range(0, len(data), Speaker.PACKET_SIZE):
+            chunk = data[offset:offset + Speaker.PACKET_SIZE]
+            packets.append([len(chunk) << 3] + _add_padding(chunk, Speaker.PACKET_SIZE))
+        return cls(packets, format, rate)
+
+    @classmethod
+    def tone(cls, frequencies, duration, rate=None, format=None, amplitude=0.8):
+        """
+        A sine tone of `duration` seconds. `frequencies` is one frequency in Hz
+        or a list of frequencies that are played one after the other.
+        The sample rate defaults to the default rate of the format.
+        """
+        if format is None:
+            format = Speaker.FORMAT_PCM8
+        if rate is None:
+            rate = Speaker.DEFAULT_RATES[format]
+        if not isinstance(frequencies, (list, tuple)):
+            frequencies = [frequencies]
+        t = np.arange(int(duration * rate)) / rate
+        fade = np.minimum(1.0, np.minimum(t, t[::-1]) / 0.005)  # avoid clicks
+        samples = np.concatenate([amplitude * fade * np.sin(2 * np.pi * frequency * t)
+                                  for frequency in frequencies])
+        return cls.from_samples(samples, rate, format)
+
+    @classmethod
+    def _encode_adpcm(cls, samples):
+        """
+        Encodes 16 bit samples as 4-bit Yamaha ADPCM, two samples per byte (first one
+        in the high nibble).
+        """
+        diff, scale = cls._ADPCM_DIFF, cls._ADPCM_SCALE
+        predictor, step = 0, 127
+        nibbles = []
+        for sample in samples:
+            delta = sample - predictor
+            nibble = min(7, abs(delta) * 4 // step) + (8 if delta < 0 else 0)
+            predictor = max(-32768, min(32767, predictor + step * diff[nibble] // 8))
+            step = max(127, min(24576, (step * scale[nibble]) >> 8))
+            nibbles.append(nibble)
+        if len(nibbles) % 2:
+            nibbles.append(0)
+        return [high << 4 | low for high, low in zip(nibbles[0::2], nibbles[1::2])]
 
 
 class Speaker(object):
     """
     Represents the speaker of the Wiimote.
+    The speaker is configured once (and again only if format, rate or volume change),
+    sounds are streamed by a thread of its own: play() returns immediately.
+    Speaker data reports are paced with nsleep() against a deadline per report,
+    so that the Wiimote's small sample buffer neither runs empty nor overflows.
     """
+
+    RPT_SPKR_ON = 0x14
+    RPT_SPKR_PLAY = 0x18
+    RPT_SPKR_MUTE = 0x19
+
+    FORMAT_ADPCM = 0x00
+    FORMAT_PCM8 = 0x40
+    DEFAULT_RATES = {FORMAT_ADPCM: 3000, FORMAT_PCM8: 2000}
+    DEFAULT_VOLUME = 0x40
+    PACKET_SIZE = 20  # data bytes per speaker report
+
+    _beep = None
+
     def __init__(self, wiimote):
-        self._playing = False
         self.wiimote = wiimote
         self._com = wiimote._com
+        self.volume = self.DEFAULT_VOLUME
+        self._configuration = None  # (connection, format, rate, volume) the speaker is set up for
+        self._configured = None  # Future of the configuration writes
+        self._cond = threading.Condition()
+        self._next = None  # Sound to be played next
+        self._playing = False
+        self._stop = False
+        self._thread = None
+
+    @property
+    def playing(self):
+        return self._next is not None or self._playing
+
+    def initialize(self, format=FORMAT_PCM8, rate=None, volume=None):
+        """
+        Enables the speaker for samples of `format` played at `rate` Hz.
+        Does nothing if the speaker is already set up this way.
+        Returns a Future that is resolved when the Wiimote has acknowledged the configuration.
+        """
+        rate = rate or self.DEFAULT_RATES[format]
+        volume = self.volume if volume is None else volume
+        configuration = (self._com, format, rate, volume)
+        if configuration == self._configuration:
+            return self._configured
+        # the sample rate register holds the divisor of a 12 MHz (PCM) or 6 MHz (ADPCM) clock
+        divisor = (12000000 if format == self.FORMAT_PCM8 else 6000000) // rate
+        memory = self.wiimote.memory
+        self._com._send(self.RPT_SPKR_ON, 0x04)
+        self._com._send(self.RPT_SPKR_MUTE, 0x04)
+        self._configured = _all_of([
+            memory.write(0xa20009, [0x01]),
+            memory.write(0xa20001, [0x08]),
+            # see http://wiibrew.org/wiki/Wiimote#Speaker
+            memory.write(0xa20001, [0x00, format] + _val_to_byte_list(divisor, 2, big_endian=False) +
+                         [volume, 0x00, 0x00]),
+            memory.write(0xa20008, [0x01])])
+        self._configuration = configuration
+        return self._configured
+
+    def play(self, sound, interrupt=True):
+        """
+        Starts playing the Sound `sound` and returns immediately.
+        If another sound is playing, it is stopped (`interrupt`) or `sound` is played after it.
+        """
+        with self._cond:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, daemon=True)
+                self._thread.start()
+            if self._playing and interrupt:
+                self._stop = True
+            self._next = sound
+            self._cond.notify()
+
+    def play_later(self, sound, delay):
+        """
+        Plays `sound` in `delay` seconds. Returns the ScheduledEvent that can be cancelled.
+        Replaces a cue that has been scheduled before and is still pending.
+        """
+        return Scheduler.default().schedule(delay, self.play, sound, key=(self, 'cue'))
+
+    def stop(self):
+        """
+        Stops the sound that is playing and cancels a pending cue.
+        """
+        Scheduler.default().cancel((self, 'cue'))
+        with self._cond:
+            self._next = None
+            self._stop = True
 
     def beep(self):
         """
         Play a short beep through the speaker
         """
-        if self._playing:
+        if Speaker._beep is None:
+            Speaker._beep = Sound.tone(1000, 0.2)
+        self.play(Speaker._beep)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while self._next is None:
+                    self._cond.wait()
+                sound, self._next = self._next, None
+                self._stop = False
+                self._playing = True
+            try:
+                self._stream(sound)
+            except Exception:
+                traceback.print_exc()
+            finally:
+                self._playing = False
+
+    def _stream(self, sound):
+        try:
+            self.initialize(sound.format, sound.rate).result(0.5)
+        except Exception as e:  # timeout or connection lost
+            _debug("speaker not configured: " + str(e))
+            self._configuration = None
             return
-        self._playing = True
-        RPT_SPKR_ON = 0x14
-        RPT_SPKR_MUTE = 0x19
-        RPT_SPKR_PLAY = 0x18
-        ON = 0x04
-        OFF = 0x00
-        self._com._send(RPT_SPKR_ON, ON)
-        self._com._send(RPT_SPKR_MUTE, ON)
-        # Write 0x01 to register 0xa20009
-        self.wiimote.memory.write(0xa20009, [0x01])
-        # Write 0x08 to register 0xa20001
-        self.wiimote.memory.write(0xa20001, [0x08])
-        # set up for 8-Bit PCM, 1000 Hz, see http://wiibrew.org/wiki/Wiimote#Speaker
-        self.wiimote.memory.write(0xa20001, [0x00, 0x40, 0x70, 0x17, 0x30, 0x00, 0x00])
-        self.wiimote.memory.write(0xa20008, [0x01])
-        self._com._send(RPT_SPKR_MUTE, OFF)
-        time.sleep(0.05)
-        num_samples = 20
-        # samples = [0, 30, 60, 90, 120, 90, 60, 30, 0, 255-30, 255-60, 255-90, 255-120, 255-90, 255-60, 255-30, 0, 0, 0, 0]
-        # samples = [0, 120, 240, 0, 120, 240, 0, 120, 240, 0, 120, 240, 0, 120, 240, 0, 120, 240, 0, 0]
-        # samples = [128,167,202,231,249,255,249,231,202,167,128,88,53,24,6,0,6,24,53,88,]
-        # samples = [0, 30, 60, 90, 120, 150, 180, 210, 240, 210, 180, 150, 120, 90, 60, 30, 0, 0, 0, 0]
-        samples = [255-128, 255-167, 255-202, 255-231, 255-249, 255-255, 255-249, 255-231, 255-202, 255-167, 255-128, 88, 53, 24, 6, 0, 6, 24, 53, 88, ]
-        for _ in range(20):
-            self._com._send(RPT_SPKR_PLAY, num_samples << 3, samples)
-            time.sleep(0.01)
-            # currently, timing does not seem to be the reason why  audio sounds awful - stay with time.sleep()
-            # nsleep(9000)
-        self._com._send(RPT_SPKR_ON, OFF)
-        self._playing = False
+        com = self._com
+        com._send(self.RPT_SPKR_MUTE, 0x00)
+        period = sound.packet_duration
+        deadline = time.monotonic() + CommandQueue.MIN_INTERVAL  # after the unmute report
+        for packet in sound.packets:
+            if self._stop:
+                break
+            delay = deadline - time.monotonic()
+            if delay > 0:
+                nsleep(delay * 1000000)
+            elif delay < -period:
+                deadline = time.monotonic()  # fell behind, do not send a burst to catch up
+            com._send(self.RPT_SPKR_PLAY, packet)
+            deadline += period
+        com._send(self.RPT_SPKR_MUTE, 0x04)
 
 
 class IRCam(object):
     """
     Represents the infrared camera of the Wiimote.
+    The visible objects are kept in a preallocated array (see IR_STATE_DTYPE) that is
+    overwritten by every IR report: `points` is a read-only (count, 4) view of rows
+    (id, x, y, size). `seq` and `time` identify the frame the state belongs to.
+    Indexing the IRCam itself, get_state() and callbacks registered without `raw` still
+    provide the list of {'id', 'x', 'y', 'size'} dicts.
     """
 
     MODE_BASIC = 1
@@ -435,35 +1315,91 @@ class IRCam(object):
 
     SUPPORTED_REPORTS = [0x33, 0x36, 0x37, 0x3e, 0x3f]
 
+    _EXTENDED_FORMAT = struct.Struct('12B')
+    _BASIC_FORMAT = struct.Struct('10B')
+    _STATE_FORMAT = struct.Struct('<17hqd')  # IR_STATE_DTYPE
+    _PADDING = [(0,) * 4 * (4 - count) for count in range(5)]  # rows of invisible objects
+    _NO_SLOT = (0, 0, 0)
+
     def __init__(self, wiimote):
         self.wiimote = wiimote
         self._com = wiimote._com
-        self._state = []
-        self._callbacks = []
+        # the whole state is written by a single pack_into(), so readers never see half a report
+        self._raw = bytearray(IR_STATE_DTYPE.itemsize)
+        self.state = np.frombuffer(self._raw, dtype=IR_STATE_DTYPE).reshape(())
+        self.state.flags.writeable = False
+        self._objects = self.state['objects']
+        self._count = 0
+        self.seq = 0  # of the last frame, 0 before the first one
+        self.time = 0.0
+        self._slots = [0] * 12  # x, y, size of the four slots for the SampleBuffer
+        self._dicts = []  # legacy state, built on demand
+        self._dicts_valid = True
+        self._callbacks = []  # called with the legacy state
+        self._array_callbacks = []  # called with the (count, 4) array
+        self._frame_callbacks = []  # called with the (count, 4) array and the accelerometer values
         self._mode = self.MODE_EXTENDED
         self._sensitivity = 3
         self.set_mode_sensitivity(self._mode, self._sensitivity)
 
     def __len__(self):
-        return len(self._state)
+        return self._count
 
     def __repr__(self):
         return repr(self._state)
 
     def __getitem__(self, slot):
-        if 0 <= slot < len(self._state):
-            return self._state[slot]
+        state = self._state
+        if 0 <= slot < len(state):
+            return state[slot]
         else:
             raise IndexError("list index out of range")
 
+    @property
+    def count(self):
+        """
+        Number of visible IR objects.
+        """
+        return self._count
+
+    @property
+    def points(self):
+        """
+        Read-only (count, 4) int16 view of the visible objects, rows are (id, x, y, size).
+        The view is overwritten by the next IR report, copy it to keep it.
+        """
+        return self._objects[:self._count]
+
+    def copy_state(self, out):
+        """
+        Copies the state into `out`, a 0-d array of IR_STATE_DTYPE (e.g. `ir.state.copy()`),
+        without allocating. Returns the (count, 4) view of the visible objects in `out`.
+        """
+        out[...] = self.state
+        return out['objects'][:out['count']]
+
+    @property
+    def _state(self):
+        """
+        The visible objects as list of dicts (legacy interface).
+        """
+        if not self._dicts_valid:
+            values = self._STATE_FORMAT.unpack_from(self._raw)
+            self._dicts = [{'id': values[i], 'x': values[i + 1], 'y': values[i + 2], 'size': values[i + 3]}
+                           for i in range(0, 4 * values[16], 4)]
+            self._dicts_valid = True
+        return self._dicts
+
     def set_mode_sensitivity(self, mode, sensitivity):
         """
         Sets sensitivity and verbosity of IR camera.
         Valid values for mode: `IRCam.MODE_BASIC`, `IRCam.MODE_EXTENDED`, `IRCam.MODE_FULL`.
-        Valid values for sensitivity: 0 (lowest) to 6 (highest).
+        Valid values for sensitivity: 0 (lowest) to 5 (highest).
         Default mode: MODE_EXTENDED
         Default sensitivity: 3
         See WiiBrew documentation.
+        The register writes are sent at once, the returned Future is resolved
+        when the Wiimote has acknowledged all of them.
         """
         if sensitivity > len(self.SENSITIVITY_BLOCKS) - 1 or \
            (mode not in [self.MODE_BASIC, self.MODE_EXTENDED, self.MODE_FULL]):
@@ -473,11 +1409,12 @@ class IRCam(object):
         self._com.set_report_mode(0x33)  # todo: adjust for other modes!!
         self._com._send(0x13, 0x04)
         self._com._send(0x1a, 0x04)
-        self.wiimote.memory.write(0xb00030, 0x08, eeprom=False)
-        self.wiimote.memory.write(0xb00000, self.SENSITIVITY_BLOCKS[mode][0], eeprom=False)
-        self.wiimote.memory.write(0xb0001a, self.SENSITIVITY_BLOCKS[mode][1], eeprom=False)
-        self.wiimote.memory.write(0xb00033, mode, eeprom=False)
-        self.wiimote.memory.write(0xb00030, 0x08, eeprom=False)
+        memory = self.wiimote.memory
+        return _all_of([memory.write(0xb00030, 0x08, eeprom=False),
+                        memory.write(0xb00000, self.SENSITIVITY_BLOCKS[sensitivity][0], eeprom=False),
+                        memory.write(0xb0001a, self.SENSITIVITY_BLOCKS[sensitivity][1], eeprom=False),
+                        memory.write(0xb00033, mode, eeprom=False),
+                        memory.write(0xb00030, 0x08, eeprom=False)])
 
     def disable(self):
         pass
@@ -486,102 +1423,568 @@ class IRCam(object):
         return self._state
 
     def set_sensitivity(self, sensitivity):
-        self.set_mode_sensitivity(self._mode, sensitivity)
+        return self.set_mode_sensitivity(self._mode, sensitivity)
 
     def set_mode(self, mode):
-        self.set_mode_sensitivity(mode, self._sensitivity)
+        return self.set_mode_sensitivity(mode, self._sensitivity)
 
-    def register_callback(self, func):
-        self._callbacks.append(func)
+    def register_callback(self, func, policy=Subscription.DELIVER_ALL, maxlen=Subscription.MAXLEN, raw=False,
+                          acc=False):
+        """
+        Register a callback function `func` that gets called with the list of
+        visible IR objects on every IR report.
+        If `raw` is True, `func` gets the (count, 4) array of `points`, the frame's `seq` and
+        its `time` instead: INLINE callbacks get the read-only view itself, queued callbacks a copy.
+        If `acc` is True as well, `func` also gets the XYZ accelerometer values of the report
+        that carried the frame (the last ones received for reports without them), so that
+        a queued callback does not combine the frame with newer accelerometer values.
+        See `Subscription` for the queueing `policy`, the Subscription is returned.
+        """
+        subscription = Subscription(func, policy, maxlen, timed=self._com.stats is not None)
+        if not raw:
+            self._callbacks.append(subscription)
+        elif acc:
+            self._frame_callbacks.append(subscription)
+        else:
+            self._array_callbacks.append(subscription)
+        return subscription
 
     def unregister_callback(self, func):
-        if func in self._callbacks:
-            self._callbacks.remove(func)
+        _unregister(self._callbacks, func)
+        _unregister(self._array_callbacks, func)
+        _unregister(self._frame_callbacks, func)
 
     def _notify_callbacks(self):
-        for callback in self._callbacks:
-            callback(self._state)
+        if self._array_callbacks or self._frame_callbacks:
+            points, seq, timestamp = self.points, self.seq, self.time
+            for subscription in self._array_callbacks:
+                subscription.post(points if subscription.policy == Subscription.INLINE else points.copy(),
+                                  seq, timestamp)
+            if self._frame_callbacks:
+                # decoded before the IR data of the same report; the list is updated in place
+                acc = list(self.wiimote.accelerometer._state)
+                for subscription in self._frame_callbacks:
+                    subscription.post(points if subscription.policy == Subscription.INLINE else points.copy(),
+                                      seq, timestamp, acc)
+        if self._callbacks:
+            state = self._state
+            for subscription in self._callbacks:
+                subscription.post(state)
+
+    def _store(self, values, dicts=None):
+        """
+        Writes the object rows collected in `values` (id, x, y, size, ...) to the state array.
+        `dicts` is the legacy state if the decoder built it for the legacy callbacks.
+        """
+        count = len(values) // 4
+        seq, timestamp = self.seq + 1, self._com.last_report
+        self._STATE_FORMAT.pack_into(self._raw, 0, *values, *self._PADDING[count], count, seq, timestamp)
+        self._count = count
+        self.seq, self.time = seq, timestamp
+        if dicts is None:
+            self._dicts_valid = False
+        else:
+            self._dicts = dicts
+            self._dicts_valid = True
 
-    def handle_report(self, report):
-        assert(report[0] in self.SUPPORTED_REPORTS)
-        # only extended mode for now!
-        ir_data = report[6:]
-        self._state = []
-        for ir_obj in range(4):
-            data = ir_data[ir_obj*3:(ir_obj+1)*3]
-            x = data[0] + ((data[2] & 0b00110000) << 4)
-            y = data[1] + ((data[2] & 0b11000000) << 2)
-            size = data[2] & 0b00001111
-            if size != 0:
-                self._state.append({'id': ir_obj, 'x': x, 'y': y, 'size': size})
+    def _decode_extended(self, report, offset=6):
+        """
+        Decodes 12 bytes of extended mode IR data (position and size of four objects)
+        at `offset` of `report`. Empty slots are transmitted as 0xff bytes and skipped.
+        """
+        data = self._EXTENDED_FORMAT.unpack_from(report, offset)
+        values = []
+        slots = self._slots
+        dicts = [] if self._callbacks else None
+        for ir_obj, i in enumerate(range(0, 12, 3)):
+            rest = data[i + 2]
+            size = rest & 0b00001111
+            if size and (rest != 0xff or (data[i] & data[i + 1]) != 0xff):
+                x = data[i] + ((rest & 0b00110000) << 4)
+                y = data[i + 1] + ((rest & 0b11000000) << 2)
+                values += ir_obj, x, y, size
+                slots[i:i + 3] = x, y, size
+                if dicts is not None:
+                    dicts.append({'id': ir_obj, 'x': x, 'y': y, 'size': size})
+            else:
+                slots[i:i + 3] = self._NO_SLOT
+        self._store(values, dicts)
+        self._notify_callbacks()
+
+    def _decode_basic(self, report, offset=3):
+        """
+        Decodes 10 bytes of basic mode IR data (position of four objects, no size)
+        at `offset` of `report`. Empty slots are transmitted as 0x3ff/0x3ff and skipped.
+        """
+        data = self._BASIC_FORMAT.unpack_from(report, offset)
+        values = []
+        slots = self._slots
+        dicts = [] if self._callbacks else None
+        for pair in range(2):
+            x1_lsb, y1_lsb, rest, x2_lsb, y2_lsb = data[pair*5:pair*5+5]
+            x1 = x1_lsb + ((rest & 0b00110000) << 4)
+            y1 = y1_lsb + ((rest & 0b11000000) << 2)
+            x2 = x2_lsb + ((rest & 0b00000011) << 8)
+            y2 = y2_lsb + ((rest & 0b00001100) << 6)
+            for ir_obj, x, y in [(pair*2, x1, y1), (pair*2+1, x2, y2)]:
+                i = ir_obj * 3
+                if x != 0x3ff or y != 0x3ff:
+                    values += ir_obj, x, y, 0
+                    slots[i:i + 3] = x, y, 0
+                    if dicts is not None:
+                        dicts.append({'id': ir_obj, 'x': x, 'y': y, 'size': 0})
+                else:
+                    slots[i:i + 3] = self._NO_SLOT
+        self._store(values, dicts)
         self._notify_callbacks()
 
 
 class Memory(object):
+    """
+    Read and write access to the EEPROM and the control registers of the Wiimote.
+    Requests do not block: read requests and writes return Futures that are completed
+    by the CommunicationHandler when the Wiimote has sent the data (0x21) or
+    acknowledged the write (0x22).
+    """
 
     RPT_READ = 0x17
     RPT_WRITE = 0x16
+    RPT_READ_DATA = 0x21
+    RPT_ACK = 0x22
 
-    SUPPORTED_REPORTS = [0x21]
+    SUPPORTED_REPORTS = [RPT_READ_DATA, RPT_ACK]
 
     MAX_ADDRESS = 0x16FF
+    MAX_CHUNK_SIZE = 16  # bytes per write request
+    TIMEOUT = 5.0
 
     def __init__(self, wiimote):
         self.wiimote = wiimote
         self._com = wiimote._com
-        self._request_in_progress = False
-        self._bytes_requested = 0
-        self._reply_buffer = []
+        self._lock = threading.RLock()  # Future callbacks may issue new requests
+        self._reads = collections.deque()  # [future, request args, bytes remaining, reply buffer]
+        self._writes = collections.deque()  # [future, unacknowledged chunks], one entry per chunk
 
     def write(self, address, data, eeprom=False):
-        address_bytes = _val_to_byte_list(address, 3, big_endian=True)
+        """
+        Writes a byte or a list of bytes `data` to `address`.
+        More than 16 bytes are split into several write requests that are sent back to back.
+        Returns a concurrent.futures.Future that is resolved when the Wiimote has
+        acknowledged all of them (or fails with a RuntimeError if it reports an error).
+        Writing no data sends nothing, the Future is resolved right away.
+        """
         bytes_to_send = _flatten(data)
         amount = len(bytes_to_send)
         if eeprom and address + amount > Memory.MAX_ADDRESS:
             raise ValueError("EEPROM address needs to be between 0x0000 and 0x16FF")
         if address < 0:
             raise ValueError("Memory address needs to be greater than 0x0000")
-        # to do: send larger blocks in multiple 16-byte requests instead of failing
-        if amount > 16:
-            raise ValueError("A maximum of 16 bytes can be sent per function call")
-        amount_byte = _val_to_byte_list(amount, 1, big_endian=True)
-        bytes_to_send = _add_padding(bytes_to_send, 16)
         control_or_eeprom = 0x00 if eeprom else 0x04
-        self._com._send(Memory.RPT_WRITE, control_or_eeprom, address_bytes, amount_byte, bytes_to_send)
-
-    def read(self, address, amount, eeprom=False):
-        if self._request_in_progress:
-            raise RuntimeError("Memory read already in progress.")
+        future = concurrent.futures.Future()
+        if amount == 0:
+            future.set_result(None)
+            return future
+        request = [future, (amount + Memory.MAX_CHUNK_SIZE - 1) // Memory.MAX_CHUNK_SIZE]
+        with self._lock:  # acks arrive in the order of the requests
+            for offset in range(0, amount, Memory.MAX_CHUNK_SIZE):
+                chunk = bytes_to_send[offset:offset + Memory.MAX_CHUNK_SIZE]
+                address_bytes = _val_to_byte_list(address + offset, 3, big_endian=True)
+                amount_byte = _val_to_byte_list(len(chunk), 1, big_endian=True)
+                self._writes.append(request)
+                self._com._send(Memory.RPT_WRITE, control_or_eeprom, address_bytes, amount_byte,
+                                _add_padding(chunk, Memory.MAX_CHUNK_SIZE))
+        return future
+
+    def request_read(self, address, amount, eeprom=False):
+        """
+        Requests `amount` bytes starting at `address`.
+        Returns a concurrent.futures.Future that resolves to the list of bytes read.
+        The Wiimote handles one read at a time, further requests are queued and
+        sent as soon as the previous one is complete. Cancelling the Future gives up
+        the request, e.g. if the reply has been lost, so that the next one is sent.
+        """
         if eeprom and address + amount > Memory.MAX_ADDRESS:
             raise ValueError("EEPROM address needs to be between 0x0000 and 0x16FF")
         if address < 0:
             raise ValueError("Memory address needs to be greater than 0x0000")
-        self._bytes_remaining = amount
+        future = concurrent.futures.Future()
+        with self._lock:
+            self._reads.append([future, (address, amount, eeprom), amount, []])
+            if len(self._reads) == 1:
+                self._send_read_request()
+        future.add_done_callback(self._read_done)
+        return future
+
+    def read(self, address, amount, eeprom=False, timeout=TIMEOUT):
+        """
+        Reads `amount` bytes starting at `address` and returns them as a list.
+        Blocks until the data has arrived, must not be called from the receive thread.
+        Raises concurrent.futures.TimeoutError after `timeout` seconds and gives up the request.
+        """
+        future = self.request_read(address, amount, eeprom)
+        try:
+            return future.result(timeout)
+        except concurrent.futures.TimeoutError:
+            future.cancel()
+            raise
+
+    async def read_async(self, address, amount, eeprom=False):
+        """
+        Coroutine variant of read() that does not block the event loop.
+        Returns the list of bytes read. Cancelling the coroutine (e.g. by asyncio.wait_for())
+        gives up the request.
+        """
+        return await asyncio.wrap_future(self.request_read(address, amount, eeprom))
+
+    def _send_read_request(self):
+        address, amount, eeprom = self._reads[0][1]
         address_bytes = _val_to_byte_list(address, 3, big_endian=True)
         amount_bytes = _val_to_byte_list(amount, 2, big_endian=True)
         control_or_eeprom = 0x00 if eeprom else 0x04
-        self._request_in_progress = True
-        self._reply_buffer = []
         self._com._send(Memory.RPT_READ, control_or_eeprom, address_bytes, amount_bytes)
-        # now wait until handle() has filled our reply buffer
-        while self._request_in_progress:
-            time.sleep(0.01)
-        return self._reply_buffer
+
+    def _read_done(self, future):
+        """
+        Removes a cancelled read request from the queue. If it has already been sent,
+        the next request is sent; a late reply is recognized by its address.
+        """
+        if not future.cancelled():
+            return
+        with self._lock:
+            for i, request in enumerate(self._reads):
+                if request[0] is future:
+                    del self._reads[i]
+                    if i == 0 and self._reads:
+                        self._send_read_request()
+                    return
+
+    def _finish_read(self, result=None, error=None):
+        future = self._reads.popleft()[0]
+        if self._reads:
+            self._send_read_request()
+        try:
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(result)
+        except concurrent.futures.InvalidStateError:
+            pass  # cancelled meanwhile
 
     def handle_report(self, report):
         if report[0] not in Memory.SUPPORTED_REPORTS:  # interleaved modes
             raise NotImplementedError("can not handle this report")
+        with self._lock:
+            if report[0] == Memory.RPT_ACK:
+                self._handle_ack(report)
+            else:
+                self._handle_read_data(report)
+
+    def _handle_read_data(self, report):
+        if not self._reads:
+            _debug("unexpected memory read data")
+            return
+        request = self._reads[0]
+        address, amount = request[1][:2]
+        # the reply carries the lower 16 bits of the address of its first byte
+        if (report[4] << 8 | report[5]) != (address + amount - request[2]) & 0xffff:
+            _debug("memory read data of an abandoned request")
+            return
         error = (report[3] & 0x0f)
         if error != 0:
-            raise RuntimeError("Error condition %x received during memory read!" % error)
+            self._finish_read(error=RuntimeError("Error condition %x received during memory read!" % error))
+            return
         num_bytes_received = ((report[3] >> 4) & 0x0f) + 1
-        data_bytes = report[6:][:num_bytes_received]
-        self._reply_buffer += data_bytes
-        self._bytes_remaining -= num_bytes_received
-        if self._bytes_remaining < 0:
-            raise RuntimeError("Memory read received more data than requested!")
-        elif self._bytes_remaining == 0:
-            self._request_in_progress = False
+        request[3] += report[6:][:num_bytes_received]
+        request[2] -= num_bytes_received
+        if request[2] < 0:
+            self._finish_read(error=RuntimeError("Memory read received more data than requested!"))
+        elif request[2] == 0:
+            self._finish_read(request[3])
+
+    def _handle_ack(self, report):
+        if report[3] != Memory.RPT_WRITE or not self._writes:
+            return  # acknowledgement of another output report
+        request = self._writes.popleft()
+        future = request[0]
+        if future.done():
+            return  # an earlier chunk failed
+        error = report[4]
+        if error != 0:
+            future.set_exception(RuntimeError("Error condition %x received during memory write!" % error))
+            return
+        request[1] -= 1
+        if request[1] == 0:
+            future.set_result(None)
+
+    def _cancel_pending(self, error):
+        """
+        Fails all outstanding requests with `error`, e.g. when the connection is lost.
+        """
+        with self._lock:
+            requests = [request[0] for request in self._reads] + [request[0] for request in self._writes]
+            self._reads.clear()
+            self._writes.clear()
+        for future in requests:
+            if not future.done():
+                future.set_exception(error)
+
+
+class SampleBuffer(object):
+    """
+    Fixed-capacity ring buffer of the most recent data reports of a Wiimote,
+    stored as records of `SAMPLE_DTYPE` (timestamp, sequence number, controller id,
+    report ID, button bitmask, accelerometer XYZ, four IR objects).
+    Unlike the sensor objects, which only hold the latest state, it allows
+    consumers to get every sample since they last looked via read_since().
+    """
+
+    # packs a whole record at once, SAMPLE_DTYPE has no padding
+    _RECORD = struct.Struct('<dQBBH3H' + 'HHB' * 4)
+    _EMPTY_IR = [0] * 12
+
+    def __init__(self, capacity=1024, controller_id=0):
+        assert SampleBuffer._RECORD.size == SAMPLE_DTYPE.itemsize
+        self.controller_id = controller_id
+        self._capacity = capacity
+        self._data = np.zeros(capacity, dtype=SAMPLE_DTYPE)
+        self._raw = memoryview(self._data.view(np.uint8))
+        self._next_seq = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return min(self._next_seq, self._capacity)
+
+    @property
+    def last_seq(self):
+        """
+        Sequence number of the newest sample, -1 if no sample has been received yet.
+        """
+        return self._next_seq - 1
+
+    def push(self, report_id, buttons, acc=None, ir=None):
+        """
+        Appends a sample, overwriting the oldest one if the buffer is full.
+        `acc` is a list of XYZ values, `ir` a flat list of x, y and size of the four
+        IR slots (zero for empty slots). Usually gets called by the Wiimote CommunicationHandler object.
+        """
+        ir_objects = ir or self._EMPTY_IR
+        x, y, z = acc or (0, 0, 0)
+        with self._lock:
+            seq = self._next_seq
+            self._RECORD.pack_into(self._raw, (seq % self._capacity) * self._RECORD.size,
+                                   time.monotonic(), seq, self.controller_id, report_id, buttons,
+                                   x, y, z, *ir_objects)
+            self._next_seq = seq + 1
+
+    def read_since(self, seq):
+        """
+        Returns all buffered samples with a sequence number greater than `seq`
+        as a (copied) structured array, oldest first. Pass -1 to get all samples.
+        Gaps in the 'seq' field show that samples have been overwritten before
+        they were read.
+        """
+        with self._lock:
+            newest = self._next_seq - 1
+            first = max(seq + 1, self._next_seq - self._capacity)
+            if first > newest:
+                return self._data[:0].copy()
+            start = first % self._capacity
+            end = newest % self._capacity + 1
+            if start < end:
+                return self._data[start:end].copy()
+            return np.concatenate((self._data[start:], self._data[:end]))
+
+
+class ReportStats(object):
+    """
+    Statistics about the reports received on one connection, collected by the
+    CommunicationHandler if enabled (see WiiMote.enable_stats()): report counts and rate,
+    a histogram of the time between reports, decoding time, and gaps in continuous
+    reporting (an interval much longer than the average one means reports were lost).
+    """
+
+    # upper bounds of the inter-arrival time histogram bins in seconds, the last bin is open
+    INTERVAL_BINS = [0.001, 0.002, 0.005, 0.0075, 0.0125, 0.02, 0.05, 0.1, 0.5]
+    # an interval counts as a gap if it is GAP_FACTOR times the average and at least MIN_GAP
+    # seconds longer, reports read in one batch make shorter intervals jitter a lot
+    GAP_FACTOR = 2.5
+    MIN_GAP = 0.01
+    SMOOTHING = 0.02  # weight of a new interval in the running average
+
+    def __init__(self):
+        self.started = time.monotonic()
+        self.reports = 0
+        self.report_types = collections.Counter()
+        self.interval_histogram = [0] * (len(self.INTERVAL_BINS) + 1)
+        self.mean_interval = None
+        self.gaps = 0
+        self.missed_reports = 0
+        self.decode_time = 0.0
+        self.max_decode_time = 0.0
+        self._last_arrival = None
+        self._intervals = 0
+        self._interval_sum = 0.0
+        self._interval_sq_sum = 0.0
+
+    def record(self, arrival, report_id, decode_time, continuous):
+        """
+        Adds a report of type `report_id` that was received at `arrival` (time.monotonic())
+        and took `decode_time` seconds to handle. Gaps are only detected if `continuous`.
+        """
+        self.reports += 1
+        self.report_types[report_id] += 1
+        self.decode_time += decode_time
+        if decode_time > self.max_decode_time:
+            self.max_decode_time = decode_time
+        last, self._last_arrival = self._last_arrival, arrival
+        if last is None:
+            return
+        interval = arrival - last
+        self.interval_histogram[bisect.bisect_left(self.INTERVAL_BINS, interval)] += 1
+        mean = self.mean_interval
+        if mean is None:
+            self.mean_interval = interval
+            return
+        if continuous and interval > max(self.GAP_FACTOR * mean, mean + self.MIN_GAP):
+            self.gaps += 1
+            self.missed_reports += max(int(round(interval / mean)) - 1, 1)
+            return  # keep the gap out of the average and the jitter
+        self.mean_interval = mean + self.SMOOTHING * (interval - mean)
+        self._intervals += 1
+        self._interval_sum += interval
+        self._interval_sq_sum += interval * interval
+
+    def snapshot(self):
+        """
+        Returns the current statistics as a dict (times in seconds).
+        """
+        elapsed = time.monotonic() - self.started
+        jitter = 0.0
+        if self._intervals > 1:
+            mean = self._interval_sum / self._intervals
+            jitter = max(self._interval_sq_sum / self._intervals - mean * mean, 0.0) ** 0.5
+        bins = ['%g' % upper for upper in self.INTERVAL_BINS] + ['+Inf']
+        return {'reports': self.reports,
+                'report_types': {'0x%02x' % rpt: count for rpt, count in sorted(self.report_types.items())},
+                'rate': self.reports / elapsed if elapsed > 0 else 0.0,
+                'current_rate': 1.0 / self.mean_interval if self.mean_interval else 0.0,
+                'interval_histogram': dict(zip(bins, self.interval_histogram)),
+                'jitter': jitter,
+                'gaps': self.gaps,
+                'missed_reports': self.missed_reports,
+                'decode_time_mean': self.decode_time / self.reports if self.reports else 0.0,
+                'decode_time_max': self.max_decode_time}
+
+
+class CommandQueue(threading.Thread):
+    """
+    Queue of output reports with a single writer thread, so that reports from the
+    receive thread, timers, the UI and the speaker do not interleave on the socket.
+    Reports that only set a state (LEDs, rumble, report mode, IR camera enable) are
+    coalesced: a newer report of the same type replaces a queued one that has not been sent yet.
+    The newer report takes the place of the last one in the queue, so reports queued in
+    between (e.g. the register writes after enabling the IR camera) are still sent after it.
+    Reports are sent at most every MIN_INTERVAL seconds, which the Wiimote can absorb.
+    """
+
+    COALESCED_REPORTS = [0x10, 0x11, 0x12, 0x13, 0x15, 0x1a]
+    MIN_INTERVAL = 0.005
+    MAX_REPORT_SIZE = 22
+
+    def __init__(self, com, sock, cmd_set_report):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self._com = com
+        self._socket = sock
+        self._queue = collections.deque()  # lists of [report ID, payload bytes...]
+        self._queued_state = {}  # report ID -> queued report that can be replaced
+        self._cond = threading.Condition()
+        self._closed = False
+        self._next_send = 0.0
+        self.sent = 0
+        self.coalesced = 0
+        # every packet is built in this buffer: transaction header, report ID, payload
+        self._packet = bytearray(self.MAX_REPORT_SIZE + 1)
+        self._packet[0] = cmd_set_report
+        self._packet_view = memoryview(self._packet)
+
+    def __len__(self):
+        return len(self._queue)
+
+    def send(self, report):
+        """
+        Queues `report`, a list of integers starting with the report ID.
+        """
+        with self._cond:
+            if self._closed:
+                _debug("connection closed, report %x not sent" % report[0])
+                return
+            rpt_type = report[0]
+            if rpt_type in self.COALESCED_REPORTS:
+                queued = self._queued_state.get(rpt_type)
+                if queued is not None:
+                    self.coalesced += 1
+                    if self._queue[-1] is queued:
+                        queued[:] = report
+                        return
+                    self._remove(queued)
+                self._queued_state[rpt_type] = report
+            self._queue.append(report)
+            self._cond.notify()
+
+    def _remove(self, report):
+        for i, queued in enumerate(self._queue):
+            if queued is report:
+                del self._queue[i]
+                return
+
+    def close(self, timeout=0.5):
+        """
+        Sends the queued reports (for at most `timeout` seconds) and stops the writer thread.
+        """
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+        if self.is_alive() and threading.current_thread() is not self:
+            self.join(timeout)
+
+    def run(self):
+        while True:
+            with self._cond:
+                while not self._queue and not self._closed:
+                    self._cond.wait()
+                if not self._queue:
+                    return
+            # wait before taking the report out of the queue so that it can still be coalesced
+            delay = self._next_send - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            with self._cond:
+                report = self._queue.popleft()
+                if self._queued_state.get(report[0]) is report:
+                    del self._queued_state[report[0]]
+            length = self._build_packet(report)
+            self._write(self._packet_view[:length])
+            self._next_send = time.monotonic() + self.MIN_INTERVAL
+            self.sent += 1
+
+    def _build_packet(self, report):
+        packet = self._packet
+        length = len(report) + 1
+        packet[1:length] = bytes(report)
+        packet[2] |= int(self._com.rumble)  # rumble bit is part of every output report
+        return length
+
+    def _write(self, packet):
+        while True:
+            try:
+                self._socket.send(packet)
+                return
+            except BlockingIOError:  # the data socket is non-blocking
+                select.select([], [self._socket], [], self.MIN_INTERVAL)
+            except OSError as e:
+                _debug("could not send report: " + str(e))
+                return
 
 
 class CommunicationHandler(threading.Thread):
@@ -591,8 +1994,19 @@ class CommunicationHandler(threading.Thread):
     MODE_ACC_IR = 0x33
 
     RPT_STATUS_REQ = 0x15
+    RPT_CONTINUOUS = 0x04  # flag of the report mode output report
 
-    def __init__(self, wiimote):
+    # without reports for this long, continuous reporting has stopped and the link is
+    # considered lost. Otherwise a status request is sent and needs to be answered in time.
+    LINK_TIMEOUT = 1.0
+
+    def __init__(self, wiimote, transport=None):
+        """
+        Opens the control and data channel to the Wiimote. `transport` is a callable
+        taking the Bluetooth address and returning (control socket, data socket). It defaults
+        to the L2CAP connection; wiimote_loopback.LoopbackDevice.connect lets a replayed or
+        simulated device take the place of the Wiimote.
+        """
         threading.Thread.__init__(self)
         self.daemon = True
         self.rumble = False  # rumble always
@@ -600,10 +2014,15 @@ class CommunicationHandler(threading.Thread):
         self.btaddr = wiimote.btaddr
         self.model = wiimote.model
         self.reporting_mode = self.MODE_DEFAULT
-        self._controlsocket = bluetooth.BluetoothSocket(bluetooth.L2CAP)
-        self._controlsocket.connect((self.btaddr, 17))
-        self._datasocket = bluetooth.BluetoothSocket(bluetooth.L2CAP)
-        self._datasocket.connect((self.btaddr, 19))
+        self.continuous = False
+        self.recorder = None  # gets every raw report passed to write(), see wiimote_capture
+        self.stats = None  # ReportStats if enabled
+        self.transport = transport
+        self._controlsocket, self._datasocket = (transport or self._connect_l2cap)(self.btaddr)
+        self.link_lost = False  # connection ended without stop()
+        self.last_report = time.monotonic()
+        self.first_report = None
+        self._probe_sent = False
         if self.model == 'Nintendo RVL-CNT-01':
             self._sendsocket = self._controlsocket
             self._CMD_SET_REPORT = 0x52
@@ -612,57 +2031,230 @@ class CommunicationHandler(threading.Thread):
             self._CMD_SET_REPORT = 0xa2
         else:
             raise Exception("unknown model")
-        try:
-            self._datasocket.settimeout(1)
-        except NotImplementedError:
-            print("socket timeout not implemented with this bluetooth module")
+        self._datasocket.setblocking(False)
+        self._decoders = {}
+        self._commands = CommandQueue(self, self._sendsocket, self._CMD_SET_REPORT)
+        self._commands.start()
+        # writing to this pipe wakes up the receive loop so that it can shut down
+        self._wakeup_r, self._wakeup_w = os.pipe()
+        self.running = False
+        self._loop = None  # asyncio event loop that watches the data socket instead of run()
+        self._event_loop = None  # the loop of attach_loop(), kept after detaching for reconnect()
+        self._manager = None  # WiimoteManager that watches the data socket instead of run()
+        self._report_queues = []  # (loop, asyncio.Queue) of WiiMote.reports() iterators
         self.set_report_mode(self.MODE_ACC_IR)
 
     def _send(self, *bytes_to_send, signed=False):
-        _debug("sending " + str(bytes_to_send))
-        data_str = self._CMD_SET_REPORT.to_bytes(1, 'big')
+        if DEBUG:
+            _debug("sending " + str(bytes_to_send))
         bytes_to_send = _flatten(bytes_to_send)
-        bytes_to_send[1] |= int(self.rumble)
-        for b in bytes_to_send:
-            data_str += b.to_bytes(1, 'big', signed=signed)
-        self._sendsocket.send(data_str)
+        if signed:
+            bytes_to_send = [b & 0xff for b in bytes_to_send]
+        self._commands.send(bytes_to_send)
 
     def run(self):
+        """
+        Receive loop: sleeps in poll() until the data socket becomes readable
+        (or stop() is called) and then handles all pending reports at once.
+        """
+        poller = select.poll()
+        poller.register(self._datasocket.fileno(), select.POLLIN | select.POLLPRI)
+        poller.register(self._wakeup_r, select.POLLIN)
         self.running = True
+        timeout = int(self.LINK_TIMEOUT * 1000)
         while self.running:
+            events = poller.poll(timeout)
+            if not events:
+                self._check_link()
+            for fd, event in events:
+                if fd == self._wakeup_r:
+                    self.running = False
+                    continue
+                if event & (select.POLLIN | select.POLLPRI):
+                    if not self._read_pending():
+                        self._lose_link("connection closed by the Wiimote")
+                if event & (select.POLLHUP | select.POLLERR | select.POLLNVAL):
+                    self._lose_link("data socket closed (poll event %x)" % event)
+        self._dispose()
+
+    def _check_link(self):
+        """
+        Called when no report has arrived for LINK_TIMEOUT seconds. Without continuous
+        reporting an idle Wiimote sends nothing, so it is probed with a status request first.
+        """
+        if time.monotonic() - self.last_report < self.LINK_TIMEOUT:
+            return
+        if self.continuous or self._probe_sent:
+            self._lose_link("no reports for %.1f s" % (time.monotonic() - self.last_report))
+        else:
+            self._probe_sent = True
+            self.last_report = time.monotonic()  # the answer is due within LINK_TIMEOUT
+            self._send(self.RPT_STATUS_REQ, int(self.rumble))
+
+    def _lose_link(self, reason):
+        _debug("link lost: " + reason)
+        self.link_lost = True
+        self.running = False
+
+    @staticmethod
+    def _connect_l2cap(btaddr):
+        bluetooth = _bluetooth()
+        controlsocket = bluetooth.BluetoothSocket(bluetooth.L2CAP)
+        controlsocket.connect((btaddr, 17))
+        datasocket = bluetooth.BluetoothSocket(bluetooth.L2CAP)
+        datasocket.connect((btaddr, 19))
+        return controlsocket, datasocket
+
+    def _read_pending(self):
+        """
+        Reads and handles all reports that are currently queued on the (non-blocking) data socket.
+        Returns False if the Wiimote has closed the connection.
+        """
+        while True:
             try:
                 data = self._datasocket.recv(32)
-            except bluetooth.BluetoothError:
-                _debug("BluetoothError while waiting for data")
-                continue
+            except OSError as e:  # bluetooth.BluetoothError is an IOError
+                if e.errno not in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    _debug("BluetoothError while reading data: " + str(e))
+                return True
             if len(data) < 2:  # disconnect!
-                self.running = False
-            else:
-                self._handle(data)
-            time.sleep(0.001)  # Wiimote: 100 Hz, check ten times as often
+                return False
+            self.last_report = time.monotonic()
+            if self.first_report is None and data[1] >= 0x30:  # first data report
+                self.first_report = self.last_report
+            self._probe_sent = False
+            self._handle(data)
+
+    def attach_loop(self, loop):
+        """
+        Lets the asyncio event loop `loop` handle incoming reports instead of this thread.
+        Must be called from the thread running `loop`, start() must not be called.
+        """
+        self._loop = self._event_loop = loop
+        self.running = True
+        loop.add_reader(self._datasocket.fileno(), self._on_readable)
+
+    def _on_readable(self):
+        if not self._read_pending():
+            self.link_lost = True
+            self._detach_loop()
+
+    def _detach_loop(self):
+        if self._loop is None:
+            return
+        self._loop.remove_reader(self._datasocket.fileno())
+        self._loop = None
         self._dispose()
 
+    def stop(self):
+        """
+        Ends the receive loop and closes the connection.
+        Returns immediately, the sockets are closed by the receive thread (or event loop).
+        """
+        self.running = False
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._detach_loop)
+            return
+        if self._manager is not None:
+            self._manager.remove(self.wiimote)
+            return
+        try:
+            os.write(self._wakeup_w, b'\x00')
+        except OSError:
+            pass  # already disposed
+
     def _dispose(self):
+        self._commands.close()
         self._datasocket.close()
         self._controlsocket.close()
+        os.close(self._wakeup_r)
+        os.close(self._wakeup_w)
         self.running = False
+        self.wiimote.memory._cancel_pending(ConnectionError("Wiimote disconnected"))
+        for loop, queue in list(self._report_queues):
+            self._post_report(loop, queue, None)  # ends the iteration
+        if self.wiimote._com is self:
+            self.wiimote._connection_closed(self.link_lost)
 
-    def set_report_mode(self, mode):
+    def _post_report(self, loop, queue, report):
+        """
+        Hands `report` to a WiiMote.reports() iterator. If its queue is full, the oldest
+        report is dropped.
+        """
+        if loop is not self._loop:  # called from the receive thread
+            loop.call_soon_threadsafe(self._put_report, queue, report)
+        else:
+            self._put_report(queue, report)
+
+    @staticmethod
+    def _put_report(queue, report):
+        if queue.full():
+            queue.get_nowait()
+        queue.put_nowait(report)
+
+    def set_report_mode(self, mode, continuous=None):
+        """
+        Selects the data reporting mode (report ID 0x30-0x3f).
+        If `continuous` is True, the Wiimote sends reports at a fixed rate (about 100 Hz),
+        otherwise only when the data changes. None keeps the current setting.
+        """
+        if continuous is not None:
+            self.continuous = continuous
         self.reporting_mode = mode
-        self._send(0x12, 0x00, mode)
+        self._send(0x12, self.RPT_CONTINUOUS if self.continuous else 0x00, mode)
+
+    def _init_decoders(self):
+        """
+        Builds the dispatch table that maps each report ID to the decoders of all
+        sensors whose data is contained in that report (see REPORT_LAYOUTS).
+        Needs to be called once all sensors of the Wiimote exist.
+        """
+        wm = self.wiimote
+        decoders = {}
+        for rpt_type, (btn_offset, acc_offset, ir_offset, ir_format) in REPORT_LAYOUTS.items():
+            rpt_decoders = []
+            if btn_offset is not None:
+                rpt_decoders.append(functools.partial(wm.buttons._decode, offset=btn_offset))
+            if acc_offset is not None:
+                rpt_decoders.append(functools.partial(wm.accelerometer._decode, offset=acc_offset))
+            if rpt_type in Memory.SUPPORTED_REPORTS:
+                rpt_decoders.append(wm.memory.handle_report)
+            if ir_format == IR_EXTENDED:
+                rpt_decoders.append(functools.partial(wm.ir._decode_extended, offset=ir_offset))
+            elif ir_format == IR_BASIC:
+                rpt_decoders.append(functools.partial(wm.ir._decode_basic, offset=ir_offset))
+            if rpt_type >= 0x30:  # data reports
+                rpt_decoders.append(functools.partial(self._push_sample, has_acc=acc_offset is not None,
+                                                      has_ir=ir_format is not None))
+            decoders[rpt_type] = tuple(rpt_decoders)
+        self._decoders = decoders
+
+    def _push_sample(self, report, has_acc, has_ir):
+        wm = self.wiimote
+        wm.samples.push(report[0], wm.buttons._mask,
+                        wm.accelerometer._state if has_acc else None,
+                        wm.ir._slots if has_ir else None)
 
     def _handle(self, bytes_read):
-        _debug("received " + str(bytes_read))
+        if DEBUG:
+            _debug("received " + str(bytes_read))
         # assert(bytes_read[0] == self._CMD_SET_REPORT + 1)
-        rpt_type = bytes_read[1]
-        # all reports include button data
-        self.wiimote.buttons.handle_report(bytes_read[1:])
-        if rpt_type in Accelerometer.SUPPORTED_REPORTS:
-            self.wiimote.accelerometer.handle_report(bytes_read[1:])
-        if rpt_type in Memory.SUPPORTED_REPORTS:
-            self.wiimote.memory.handle_report(bytes_read[1:])
-        if rpt_type in IRCam.SUPPORTED_REPORTS:
-            self.wiimote.ir.handle_report(bytes_read[1:])
+        recorder = self.recorder  # may be detached by another thread meanwhile
+        if recorder is not None:
+            recorder.write(bytes_read)
+        # strip the transaction header without copying the report
+        report = memoryview(bytes_read)[1:]
+        stats = self.stats
+        if stats is not None:
+            start = time.perf_counter()
+        for decode in self._decoders.get(report[0], ()):
+            decode(report)
+        if stats is not None:
+            stats.record(self.last_report, report[0], time.perf_counter() - start, self.continuous)
+        if self._report_queues:
+            report = bytes(report)
+            for loop, queue in self._report_queues:
+                self._post_report(loop, queue, report)
 
     def set_rumble(self, state):
         self.rumble = state
@@ -672,12 +2264,29 @@ class CommunicationHandler(threading.Thread):
 
 class WiiMote(object):
 
+    # data reporting modes, see set_report_mode()
+    MODE_DEFAULT = CommunicationHandler.MODE_DEFAULT  # buttons
+    MODE_ACC = CommunicationHandler.MODE_ACC  # buttons, accelerometer
+    MODE_ACC_IR = CommunicationHandler.MODE_ACC_IR  # buttons, accelerometer, IR camera
+
     # instance methods
-    def __init__(self, btaddr, model):
+    def __init__(self, btaddr, model, threaded=True, controller_id=0, transport=None):
+        """
+        Connects to the Wiimote. If `threaded` is False, no receive thread is started
+        and incoming reports need to be handled by an event loop (see connect_async())
+        or a WiimoteManager. `controller_id` is stored with every sample.
+        `transport` replaces the Bluetooth connection (see CommunicationHandler).
+        """
         self.btaddr = btaddr
         self.model = model
+        self.controller_id = controller_id
         self.connected = False
-        self._com = CommunicationHandler(self)
+        self._adaptive_reporting = None
+        self._disconnect_callbacks = []
+        self._threaded = threaded
+        self._connect_started = time.monotonic()  # moved back by connect() to include the lookup
+        self._com = CommunicationHandler(self, transport)
+        self.connected = True
         self._leds = LEDs(self)
         self.accelerometer = Accelerometer(self)
         self.buttons = Buttons(self)
@@ -685,17 +2294,200 @@ class WiiMote(object):
         self.speaker = Speaker(self)
         self.memory = Memory(self)
         self.ir = IRCam(self)
+        self.samples = SampleBuffer(controller_id=controller_id)
+        self._com._init_decoders()
         """
         Initializations before this point may not read from memory as
         this would block forever (until the CommunicationHandler is started).
         CommunicationHandler can not be started earlier because the sensors
         would not yet be assigned to variables
         """
-        self._com.start()
+        if threaded:
+            self._com.start()
         self.leds[0] = True  # set first LED to signal successful connection.
 
     def disconnect(self):
-        self._com.running = False
+        self._com.stop()
+
+    def reconnect(self, transport=None):
+        """
+        Opens a new connection to the Wiimote after the old one has been closed or lost.
+        Sensors, callbacks and samples are kept; report mode, IR camera settings and
+        LEDs are restored. Uses the transport of the old connection if `transport` is None.
+        A connection that was handled by an event loop (see connect_async()) is handed to the
+        same loop again; from another thread it is attached once the loop gets to it.
+        Raises the connection error if the Wiimote can not be reached.
+        """
+        old = self._com
+        if old.running:
+            raise RuntimeError("Wiimote is still connected")
+        loop = old._event_loop
+        if loop is not None and loop.is_closed():
+            raise RuntimeError("the event loop of the connection has been closed")
+        self._connect_started = time.monotonic()
+        com = CommunicationHandler(self, transport or old.transport)
+        for component in [self._leds, self.accelerometer, self.buttons, self.speaker, self.memory, self.ir]:
+            component._com = com
+        com.recorder = old.recorder
+        com.stats = old.stats
+        self._com = com
+        self.connected = True
+        for subscription in self._subscriptions():
+            subscription.reopen()
+        com._init_decoders()
+        if old._manager is not None:
+            old._manager.add(self)
+        elif loop is not None:
+            try:
+                current = asyncio.get_running_loop()
+            except RuntimeError:
+                current = None
+            if current is loop:
+                com.attach_loop(loop)
+            else:
+                loop.call_soon_threadsafe(com.attach_loop, loop)
+        elif self._threaded:
+            com.start()
+        self.ir.set_mode_sensitivity(self.ir._mode, self.ir._sensitivity)
+        com.set_report_mode(old.reporting_mode, old.continuous)
+        self._leds.set_leds(self._leds._state)
+
+    def startup_time(self):
+        """
+        Returns the seconds from the start of the connection (including the model lookup
+        of connect()) to the first received report, or None if no report has arrived yet.
+        """
+        if self._com.first_report is None:
+            return None
+        return self._com.first_report - self._connect_started
+
+    def register_disconnect_callback(self, func):
+        """
+        Register a callback function `func` that gets called with the WiiMote when the
+        connection has been lost, i.e. closed without calling disconnect().
+        It is called on the receive thread.
+        """
+        self._disconnect_callbacks.append(func)
+
+    def unregister_disconnect_callback(self, func):
+        if func in self._disconnect_callbacks:
+            self._disconnect_callbacks.remove(func)
+
+    def _connection_closed(self, link_lost):
+        self.connected = False
+        for subscription in self._subscriptions():
+            subscription.close()  # reconnect() reopens them
+        if not link_lost:
+            return
+        for func in list(self._disconnect_callbacks):
+            try:
+                func(self)
+            except Exception:
+                traceback.print_exc()
+
+    def set_report_mode(self, mode, continuous=None):
+        """
+        Selects the data reporting mode, e.g. WiiMote.MODE_ACC_IR (0x33).
+        If `continuous` is True, reports are sent at a fixed rate instead of on changes only.
+        """
+        self._com.set_report_mode(mode, continuous)
+
+    def get_report_mode(self):
+        """
+        Returns the data reporting mode and whether reporting is continuous,
+        e.g. to restore them later with set_report_mode(mode, continuous).
+        """
+        return self._com.reporting_mode, self._com.continuous
+
+    def enable_adaptive_reporting(self, idle_mode=CommunicationHandler.MODE_ACC,
+                                  active_mode=CommunicationHandler.MODE_ACC_IR, button='B'):
+        """
+        Uses `active_mode` (accelerometer + IR by default) only while `button` is held
+        and `idle_mode` (accelerometer only) otherwise. This saves radio bandwidth and
+        decoding work while nobody is drawing. Note that the IR state is not updated in idle mode.
+        """
+        self.disable_adaptive_reporting()
+
+        def switch_mode(events):
+            for event in events:
+                if event.button == button and event.kind in [Buttons.PRESS, Buttons.RELEASE]:
+                    self._com.set_report_mode(active_mode if event.pressed else idle_mode)
+
+        self._adaptive_reporting = (switch_mode, active_mode)
+        self.buttons.register_callback(switch_mode, Subscription.INLINE)
+        self._com.set_report_mode(active_mode if self.buttons[button] else idle_mode)
+
+    def disable_adaptive_reporting(self):
+        """
+        Stops switching report modes and returns to the active mode.
+        """
+        if self._adaptive_reporting is None:
+            return
+        switch_mode, active_mode = self._adaptive_reporting
+        self._adaptive_reporting = None
+        self.buttons.unregister_callback(switch_mode)
+        self._com.set_report_mode(active_mode)
+
+    def enable_stats(self):
+        """
+        Starts collecting report statistics and measuring callback execution times,
+        see stats(). Restarts the statistics if they are already enabled.
+        """
+        self._com.stats = ReportStats()
+        for subscription in self._subscriptions():
+            subscription.timed = True
+
+    def disable_stats(self):
+        self._com.stats = None
+        for subscription in self._subscriptions():
+            subscription.timed = False
+
+    def stats(self):
+        """
+        Returns the report statistics (None unless enable_stats() has been called),
+        the startup time (see startup_time()), queue depths and callback statistics
+        as a dict, see export_stats() for dashboards.
+        """
+        com = self._com
+        return {'controller': self.controller_id,
+                'startup_time': self.startup_time(),
+                'reports': com.stats.snapshot() if com.stats is not None else None,
+                'queues': {'commands': len(com._commands),
+                           'report_iterators': [queue.qsize() for _, queue in com._report_queues]},
+                'callbacks': self.callback_stats()}
+
+    def _subscriptions(self):
+        return (self.accelerometer._callbacks + self.buttons._callbacks +
+                self.ir._callbacks + self.ir._array_callbacks + self.ir._frame_callbacks)
+
+    def callback_stats(self):
+        """
+        Returns queue depth, delivered and dropped event counts of all registered callbacks.
+        """
+        return {'accelerometer': [sub.stats() for sub in self.accelerometer._callbacks],
+                'buttons': [sub.stats() for sub in self.buttons._callbacks],
+                'ir': [sub.stats() for sub in
+                       self.ir._callbacks + self.ir._array_callbacks + self.ir._frame_callbacks]}
+
+    async def reports(self, maxsize=256):
+        """
+        Asynchronous iterator over all incoming reports, e.g.
+        `async for report in wm.reports():`. Each report is a bytes object
+        starting with the report ID, sensor states are already updated when it is yielded.
+        At most `maxsize` reports are queued, older ones are dropped if the consumer is too slow.
+        Ends when the connection is closed.
+        """
+        entry = (asyncio.get_running_loop(), asyncio.Queue(maxsize))
+        com = self._com  # reconnect() replaces self._com, the entry stays with this one
+        com._report_queues.append(entry)
+        try:
+            while True:
+                report = await entry[1].get()
+                if report is None:
+                    return
+                yield report
+        finally:
+            com._report_queues.remove(entry)
 
     def _get_capabilities(self):
         return None
@@ -723,3 +2515,284 @@ class WiiMote(object):
 
     leds = property(get_leds, set_leds)
     # rumble = property(get_rumble, set_rumble)
+
+
+class WiimoteManager(threading.Thread):
+    """
+    Serves several Wiimotes from a single receive thread: the data sockets of all
+    controllers are watched by one poll() loop instead of one CommunicationHandler
+    thread per Wiimote. Controllers are numbered in the order they are added; the
+    controller id is stored with their samples and selects their stream.
+    Lost links are detected as by a CommunicationHandler (see LINK_TIMEOUT).
+    """
+
+    def __init__(self):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self._wiimotes = {}  # controller id -> WiiMote
+        self._next_id = 0
+        self._lock = threading.Lock()
+        self._changes = collections.deque()  # (WiiMote, add?) to be applied by the poll loop
+        self._wakeup_r, self._wakeup_w = os.pipe()
+        self.running = False
+        self._closed = False  # after disconnect_all()
+
+    def __len__(self):
+        return len(self._wiimotes)
+
+    def __getitem__(self, controller_id):
+        return self._wiimotes[controller_id]
+
+    def __iter__(self):
+        return iter(list(self._wiimotes.values()))
+
+    def connect(self, btaddr, model=None):
+        """
+        Connects to the Wiimote at `btaddr` (see connect()) and adds it to the manager.
+        Returns the WiiMote object, its id is available as `controller_id`.
+        """
+        started = time.monotonic()
+        model = _lookup_model(btaddr, model)
+        with self._lock:
+            controller_id = self._next_id
+            self._next_id += 1
+        wiimote = WiiMote(btaddr, model, threaded=False, controller_id=controller_id)
+        wiimote._connect_started = started
+        DeviceCache.default().update(btaddr, model)
+        return self.add(wiimote)
+
+    def add(self, wiimote):
+        """
+        Adds a WiiMote that has been created with `threaded=False`.
+        Starts the poll loop if it is not running yet.
+        """
+        with self._lock:
+            if self._closed:
+                raise RuntimeError("WiimoteManager has been shut down")
+            if wiimote.controller_id in self._wiimotes:
+                wiimote.controller_id = wiimote.samples.controller_id = self._next_id
+            self._next_id = max(self._next_id, wiimote.controller_id + 1)
+            self._wiimotes[wiimote.controller_id] = wiimote
+            wiimote._com._manager = self
+            wiimote._com.running = True
+            self._changes.append((wiimote, True))
+            if not self.running:
+                self.running = True
+                self.start()
+            os.write(self._wakeup_w, b'\x00')
+        return wiimote
+
+    def remove(self, wiimote):
+        """
+        Disconnects `wiimote` and stops serving it. Returns immediately.
+        """
+        with self._lock:
+            if self._closed:
+                return  # already disconnected by disconnect_all()
+            self._wiimotes.pop(wiimote.controller_id, None)
+            self._changes.append((wiimote, False))
+            os.write(self._wakeup_w, b'\x00')
+
+    def disconnect_all(self):
+        """
+        Disconnects all Wiimotes and ends the poll loop. The manager can not be used afterwards.
+        """
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            for wiimote in self._wiimotes.values():
+                self._changes.append((wiimote, False))
+            self._wiimotes.clear()
+            started = self.running
+            self.running = False
+            if started:
+                os.write(self._wakeup_w, b'\x00')
+        if not started:
+            self._close_pipe()
+        elif threading.current_thread() is not self:
+            self.join()
+
+    def stream(self, controller_id):
+        """
+        Returns the SampleBuffer of a controller.
+        """
+        return self._wiimotes[controller_id].samples
+
+    def read_since(self, cursors):
+        """
+        Returns the samples of all controllers that are newer than the sequence
+        numbers in `cursors` (dict of controller id -> seq, missing ids start at -1)
+        as one array sorted by time, and the updated cursors.
+        """
+        cursors = dict(cursors)
+        chunks = []
+        for wiimote in self:
+            samples = wiimote.samples.read_since(cursors.get(wiimote.controller_id, -1))
+            if len(samples):
+                chunks.append(samples)
+                cursors[wiimote.controller_id] = int(samples['seq'][-1])
+        if not chunks:
+            return np.zeros(0, dtype=SAMPLE_DTYPE), cursors
+        merged = np.concatenate(chunks)
+        return merged[np.argsort(merged['time'], kind='stable')], cursors
+
+    def run(self):
+        poller = select.poll()
+        poller.register(self._wakeup_r, select.POLLIN)
+        served = {}  # fd -> WiiMote
+        # the links are checked while other controllers keep the poll busy, too
+        interval = CommunicationHandler.LINK_TIMEOUT / 2
+        next_check = time.monotonic() + interval
+        while self.running:
+            for fd, event in poller.poll(int(interval * 1000)):
+                if fd == self._wakeup_r:
+                    os.read(self._wakeup_r, 512)
+                    self._apply_changes(poller, served)
+                    continue
+                wiimote = served.get(fd)
+                if wiimote is None:
+                    continue
+                alive = True
+                if event & (select.POLLIN | select.POLLPRI):
+                    alive = wiimote._com._read_pending()
+                if not alive or event & (select.POLLHUP | select.POLLERR | select.POLLNVAL):
+                    self._lose(poller, served, fd)
+            now = time.monotonic()
+            if now >= next_check:
+                next_check = now + interval
+                for fd, wiimote in list(served.items()):
+                    wiimote._com._check_link()
+                    if wiimote._com.link_lost:
+                        self._lose(poller, served, fd)
+        self._apply_changes(poller, served)  # removals of disconnect_all()
+        for fd in list(served):
+            self._drop(poller, served, fd)
+        with self._lock:
+            self._close_pipe()
+
+    def _close_pipe(self):
+        os.close(self._wakeup_r)
+        os.close(self._wakeup_w)
+
+    def _lose(self, poller, served, fd):
+        wiimote = served[fd]
+        _debug("controller %d disconnected" % wiimote.controller_id)
+        wiimote._com.link_lost = True
+        with self._lock:
+            self._wiimotes.pop(wiimote.controller_id, None)
+        self._drop(poller, served, fd)
+
+    def _apply_changes(self, poller, served):
+        while self._changes:
+            wiimote, add = self._changes.popleft()
+            fd = wiimote._com._datasocket.fileno()
+            if add:
+                served[fd] = wiimote
+                poller.register(fd, select.POLLIN | select.POLLPRI)
+            elif fd in served:
+                self._drop(poller, served, fd)
+
+    @staticmethod
+    def _drop(poller, served, fd):
+        poller.unregister(fd)
+        served.pop(fd)._com._dispose()
+
+
+class ConnectionSupervisor(threading.Thread):
+    """
+    Keeps a Wiimote connected: connects in the background, retrying with exponential
+    backoff until the Wiimote is reachable, and reconnects the same WiiMote object
+    (see WiiMote.reconnect()) whenever the link is lost.
+    `on_connect` is called with the WiiMote after every (re)connection, `on_disconnect`
+    when the link has been lost. Both are called on the supervisor thread.
+    """
+
+    MIN_BACKOFF = 0.5
+    MAX_BACKOFF = 8.0
+
+    def __init__(self, btaddr, model=None, on_connect=None, on_disconnect=None, transport=None):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.btaddr = btaddr
+        self.model = model
+        self.on_connect = on_connect
+        self.on_disconnect = on_disconnect
+        self.transport = transport
+        self.wiimote = None
+        self.attempts = 0  # failed connection attempts since the last connection
+        self.running = False
+        self._wakeup = threading.Event()  # link lost or stop()
+        self._connected = threading.Event()
+
+    def wait_connected(self, timeout=None):
+        """
+        Blocks until the Wiimote is connected. Returns the WiiMote, or None on timeout.
+        """
+        if self._connected.wait(timeout):
+            return self.wiimote
+        return None
+
+    def stop(self):
+        """
+        Stops reconnecting and disconnects the Wiimote.
+        """
+        self.running = False
+        self._wakeup.set()
+        if self.wiimote is not None and self.wiimote.connected:
+            self.wiimote.disconnect()
+
+    def start(self):
+        self.running = True
+        threading.Thread.start(self)
+
+    def run(self):
+        backoff = self.MIN_BACKOFF
+        while self.running:
+            try:
+                self._connect()
+            except Exception as e:  # Wiimote not in range or not in discoverable mode
+                self.attempts += 1
+                _debug("connecting to %s failed (%s), retry in %.1f s" % (self.btaddr, e, backoff))
+                self._wakeup.wait(backoff)
+                backoff = min(backoff * 2, self.MAX_BACKOFF)
+                continue
+            backoff = self.MIN_BACKOFF
+            self.attempts = 0
+            self._connected.set()
+            self._call(self.on_connect)
+            self._wakeup.wait()
+            self._wakeup.clear()
+            self._connected.clear()
+            if not self.running:
+                break
+            self._call(self.on_disconnect)
+
+    def _connect(self):
+        if self.wiimote is None:
+            started = time.monotonic()
+            model = self.model
+            if self.transport is None:
+                model = _lookup_model(self.btaddr, model)
+            wiimote = WiiMote(self.btaddr, model, transport=self.transport)
+            wiimote._connect_started = started
+            wiimote.register_disconnect_callback(self._link_lost)
+            self.model = model
+            self.wiimote = wiimote
+        else:
+            self.wiimote.reconnect()
+        if self.transport is None:
+            DeviceCache.default().update(self.btaddr, self.model)
+        if not self.running:
+            self.wiimote.disconnect()
+
+    def _link_lost(self, wiimote):
+        self._wakeup.set()
+
+    def _call(self, func):
+        if func is None:
+            return
+        try:
+            func(self.wiimote)
+        except Exception:
+            traceback.print_exc()
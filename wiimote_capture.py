@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+# coding: utf-8
+
+# Recording and replay of Wiimote sessions
+#
+# A capture file starts with a 16 byte header (magic, format version, record size)
+# followed by fixed-size records, one per input report:
+#   time    float64    time.monotonic() when the report was received
+#   length  uint8      number of valid bytes in `data`
+#   data    23 x uint8 the report as read from the data socket (0xa1, report ID, payload)
+# Records are only ever appended, so a capture can be read with numpy.memmap
+# (see load_capture()) while it is still being written.
+
+import struct
+import threading
+import time
+import numpy as np
+import wiimote
+import wiimote_loopback
+
+MAGIC = b'WIIMCAP\x00'
+VERSION = 1
+HEADER = struct.Struct('<8sII')
+DATA_SIZE = 23
+CAPTURE_DTYPE = np.dtype([('time', '<f8'), ('length', 'u1'), ('data', 'u1', (DATA_SIZE,))])
+
+# replies to memory requests of the recorded session, the replayed WiiMote sends its own
+MEMORY_REPORTS = [wiimote.Memory.RPT_READ_DATA, wiimote.Memory.RPT_ACK]
+
+
+def record(wm, path):
+    """
+    Starts recording all reports received by the WiiMote `wm` to the capture file at `path`.
+    Returns the CaptureRecorder, close() stops the recording.
+    """
+    recorder = CaptureRecorder(path)
+    recorder.attach(wm)
+    return recorder
+
+
+def load_capture(path):
+    """
+    Maps the records of the capture file at `path` into memory.
+    Returns a read-only numpy array with CAPTURE_DTYPE.
+    Example - decode all accelerometer/IR reports of a session:
+        reports = load_capture(path)
+        data = reports['data'][reports['data'][:, 1] == 0x33]
+        decoded = wiimote.decode_reports(data)
+    """
+    with open(path, 'rb') as f:
+        magic, version, record_size = HEADER.unpack(f.read(HEADER.size))
+    if magic != MAGIC or record_size != CAPTURE_DTYPE.itemsize:
+        raise ValueError("%s is not a Wiimote capture" % path)
+    if version != VERSION:
+        raise ValueError("unsupported capture version %d" % version)
+    num_records = (_file_size(path) - HEADER.size) // CAPTURE_DTYPE.itemsize
+    if num_records == 0:
+        return np.zeros(0, dtype=CAPTURE_DTYPE)
+    return np.memmap(path, dtype=CAPTURE_DTYPE, mode='r', offset=HEADER.size, shape=(num_records,))
+
+
+def replay(path, speed=1.0, threaded=True, controller_id=0):
+    """
+    Connects a WiiMote to a ReplayDevice playing back the capture at `path`.
+    The WiiMote is disconnected once the capture has been played.
+    """
+    device = ReplayDevice(path, speed)
+    return wiimote.WiiMote('replay:' + path, device.MODEL, threaded=threaded,
+                           controller_id=controller_id, transport=device.connect)
+
+
+def _file_size(path):
+    with open(path, 'rb') as f:
+        return f.seek(0, 2)
+
+
+class CaptureRecorder(object):
+    """
+    Appends reports to a capture file. A new file gets a header, an existing capture
+    is continued. write() is called from the receive thread for every report,
+    close() may be called from any thread: reports arriving afterwards are not written.
+    """
+
+    _RECORD = struct.Struct('<dB%ds' % DATA_SIZE)
+
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, 'ab')
+        if self._file.tell() == 0:
+            self._file.write(HEADER.pack(MAGIC, VERSION, CAPTURE_DTYPE.itemsize))
+        else:
+            load_capture(path)  # raises if this is not a capture file
+        self._wiimote = None
+        self._lock = threading.Lock()
+        self.records = 0
+
+    def attach(self, wm):
+        self._wiimote = wm
+        wm._com.recorder = self  # taken over by reconnect()
+
+    def write(self, data):
+        length = min(len(data), DATA_SIZE)
+        # struct pads the data with zeros
+        record = self._RECORD.pack(time.monotonic(), length, bytes(data[:length]))
+        with self._lock:
+            if self._file.closed:
+                return
+            self._file.write(record)
+            self.records += 1
+
+    def flush(self):
+        with self._lock:
+            if not self._file.closed:
+                self._file.flush()
+
+    def close(self):
+        wm, self._wiimote = self._wiimote, None
+        if wm is not None and wm._com.recorder is self:
+            wm._com.recorder = None
+        with self._lock:
+            self._file.close()
+
+
+class ReplayDevice(wiimote_loopback.LoopbackDevice):
+    """
+    Sends the reports of a capture file with their recorded timing.
+    `speed` scales the playback rate: 1.0 is real time, 2.0 twice as fast,
+    and 0 (or None) sends the reports as fast as the receiver reads them.
+    The device disconnects at the end of the capture unless `loop` is True.
+    """
+
+    def __init__(self, path, speed=1.0, loop=False):
+        wiimote_loopback.LoopbackDevice.__init__(self)
+        self.records = load_capture(path)
+        self.speed = speed
+        self.loop = loop
+        self.sent = 0
+
+    def produce(self):
+        records = self.records[~np.isin(self.records['data'][:, 1], MEMORY_REPORTS)]
+        if len(records) == 0:
+            return
+        offsets = records['time'] - records['time'][0]
+        if self.speed:
+            offsets = offsets / self.speed
+        while self.running:
+            start = time.monotonic()
+            for offset, length, data in zip(offsets.tolist(), records['length'].tolist(),
+                                            records['data']):
+                if self.speed:
+                    if not self.wait(start + offset - time.monotonic()):
+                        return
+                elif not self.wait(0):
+                    return
+                self._socket.send(data[:length].tobytes())
+                self.sent += 1
+            if not self.loop:
+                return
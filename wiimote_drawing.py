@@ -1,100 +1,275 @@
 from PyQt5 import QtCore
-import pylab as pl
-import scipy
+import numpy as np
 import sys
 import time
-from threading import Timer, Thread, Event
 import math
-
-
-def init(wiimote):
-    return WiimoteDrawing(wiimote)
-
-
-# Source: https://stackoverflow.com/a/12435256
-class ProcessingThread(Thread):
-    def __init__(self, processing_function, update_rate, stop_event):
-        Thread.__init__(self)
-        self.stopped = stop_event
-        self.processing_function = processing_function
-
-        self.update_rate = update_rate
-        self.sleep_time = 0
-
-    def run(self):
-        while not self.stopped.wait(self.sleep_time):
-            start = time.time()
-            self.processing_function()
-            end = time.time()
-            sleep_time = (1 / self.update_rate) - (end - start)
-            self.sleep_time = max(0, sleep_time)
+from pointer_filter import OneEuroFilter
+
+
+def init(wiimote, pointer_filter=None):
+    return WiimoteDrawing(wiimote, pointer_filter)
+
+
+def _basis_coefficients(x1, y1, x2, y2, x3, y3, x, y, batch=False):
+    """
+    Solves l * (x1, y1, 1) + m * (x2, y2, 1) + t * (x3, y3, 1) = (x, y, 1) for (l, m, t)
+    with Cramer's rule. Returns None if the three points are on a line.
+    With `batch`, the coordinates are arrays and degenerate rows are inf/nan instead.
+    """
+    det = x1 * (y2 - y3) + x2 * (y3 - y1) + x3 * (y1 - y2)
+    if not batch and det == 0:
+        return None
+    l = (x * (y2 - y3) + x2 * (y3 - y) + x3 * (y - y2)) / det
+    m = (x1 * (y - y3) + x * (y3 - y1) + x3 * (y1 - y)) / det
+    t = (x1 * (y2 - y) + x2 * (y - y1) + x * (y1 - y2)) / det
+    return l, m, t
+
+
+def order_corners(points):
+    """
+    Orders the corners of a quadrilateral, `points` is a (4, 2) array or an (N, 4, 2) batch.
+    The corners are sorted by their angle around the centroid (clockwise on screen, as
+    the y axis of the IR camera points down), starting at the leftmost corner or the one
+    after it, whichever makes the first and third side the longer pair of opposite sides.
+    Unlike the former min/max search this always returns four distinct input points;
+    degenerate frames (e.g. duplicates) are left to calc_drawing_point.
+    """
+    points = np.asarray(points)
+    center = points.mean(axis=-2, keepdims=True)
+    angles = np.arctan2(points[..., 1] - center[..., 1], points[..., 0] - center[..., 0])
+    ordered = np.take_along_axis(points, np.argsort(angles, axis=-1, kind='stable')[..., None], axis=-2)
+
+    # sides[..., i] is the side from corner i to corner i + 1
+    sides = np.hypot(*np.moveaxis(np.roll(ordered, -1, axis=-2) - ordered, -1, 0))
+    # the leftmost corner (the first one in angular order on ties) starts a long side?
+    leftmost = np.argmin(ordered[..., 0], axis=-1)[..., None]
+    even_sides = (sides[..., 0] + sides[..., 2])[..., None]
+    odd_sides = (sides[..., 1] + sides[..., 3])[..., None]
+    starts_long = np.where(leftmost % 2 == 0, even_sides >= odd_sides, odd_sides >= even_sides)
+    start = np.where(starts_long, leftmost, leftmost + 1)
+    return np.take_along_axis(ordered, ((start + np.arange(4)) % 4)[..., None], axis=-2)
+
+
+def sort_corners(points):
+    """
+    Orders four (x, y) points as corners of the sensor bar rectangle, see order_corners()
+    (which has too much overhead for a single frame). Returns a list of (x, y) tuples.
+    """
+    center_x = sum(p[0] for p in points) / 4
+    center_y = sum(p[1] for p in points) / 4
+    ordered = sorted(points, key=lambda p: math.atan2(p[1] - center_y, p[0] - center_x))
+    sides = [math.hypot(b[0] - a[0], b[1] - a[1]) for a, b in zip(ordered, ordered[1:] + ordered[:1])]
+    leftmost = min(range(4), key=lambda i: ordered[i][0])
+    if leftmost % 2 == 0:
+        starts_long = sides[0] + sides[2] >= sides[1] + sides[3]
+    else:
+        starts_long = sides[1] + sides[3] >= sides[0] + sides[2]
+    if not starts_long:
+        leftmost += 1
+    return [tuple(ordered[(leftmost + i) % 4]) for i in range(4)]
+
+
+class IRTracker(object):
+    """
+    Keeps track of the four sensor bar corners across IR frames.
+    The visible points of a frame are assigned to the corners of the previous frame by
+    nearest neighbour, so the corners keep their identity (and order) while the Wiimote
+    moves; the points are only sorted from scratch (sort_corners()) when tracking starts
+    or the assignment fails. If one corner is missing, its position is predicted from the
+    other three: its affine coordinates relative to them stay the same as in the last
+    quad in which it was visible.
+    `max_distance` is the maximum movement of a corner between two frames in camera pixels;
+    it is reduced to half the shortest side of the quad when the sensor bar is far away.
+    """
+
+    MAX_DISTANCE = 80
+
+    def __init__(self, max_distance=MAX_DISTANCE):
+        self.max_distance = max_distance
+        self.corners = None  # last quad, list of four (x, y)
+        self.predicted = None  # index of the predicted corner in the last quad, or None
+        self.resorts = 0
+        self.predictions = 0
+        self._assignment = None  # corner index for each point of the last frame
+        self._max_dist = 0  # squared
+        self._coefficients = None  # affine coordinates of the predicted corner
+
+    def reset(self):
+        self.corners = None
+        self.predicted = None
+        self._assignment = None
+
+    def update(self, points):
+        """
+        Updates the corners with the visible `points` of a new frame, a sequence of (x, y).
+        Returns the four corners in sort_corners() order, or None if they are unknown
+        (fewer than four points without a previous quad, or fewer than three points).
+        """
+        if len(points) < 3 or len(points) > 4 or (self.corners is None and len(points) != 4):
+            self.reset()
+            return None
+        if self.corners is not None:
+            assignment = self._assign(points)
+            if assignment is not None:
+                return self._apply(points, assignment)
+        if len(points) != 4:
+            self.reset()
+            return None
+        self._set_corners(sort_corners(points), None, None)
+        self.resorts += 1
+        return self.corners
+
+    def _assign(self, points):
+        """
+        Returns the corner index for each point, None if a point is too far from all corners.
+        """
+        corners = self.corners
+        max_dist = self._max_dist
+        # identities are usually stable: the camera keeps reporting an object in its slot
+        assignment = self._assignment
+        if assignment is not None and len(assignment) == len(points):
+            for (x, y), corner in zip(points, assignment):
+                cx, cy = corners[corner]
+                if (x - cx) * (x - cx) + (y - cy) * (y - cy) > max_dist:
+                    break
+            else:
+                return assignment
+        pairs = sorted(((x - cx) * (x - cx) + (y - cy) * (y - cy), point, corner)
+                       for point, (x, y) in enumerate(points)
+                       for corner, (cx, cy) in enumerate(corners))
+        assignment = [None] * len(points)
+        used = set()
+        for dist, point, corner in pairs:
+            if dist > max_dist:
+                break
+            if assignment[point] is None and corner not in used:
+                assignment[point] = corner
+                used.add(corner)
+        return None if None in assignment else assignment
+
+    def _apply(self, points, assignment):
+        corners = [None] * 4
+        for point, corner in zip(points, assignment):
+            corners[corner] = point
+        predicted = None
+        if len(points) == 3:
+            predicted = corners.index(None)
+            known = [i for i in range(4) if i != predicted]
+            if predicted != self.predicted:
+                # computed once per dropout, so that the prediction errors do not add up
+                (x1, y1), (x2, y2), (x3, y3) = [self.corners[i] for i in known]
+                self._coefficients = _basis_coefficients(x1, y1, x2, y2, x3, y3, *self.corners[predicted])
+                if self._coefficients is None:
+                    self.reset()
+                    return None
+            l, m, t = self._coefficients
+            (x1, y1), (x2, y2), (x3, y3) = [corners[i] for i in known]
+            corners[predicted] = (l * x1 + m * x2 + t * x3, l * y1 + m * y2 + t * y3)
+            self.predictions += 1
+        self._set_corners(corners, predicted, assignment)
+        return corners
+
+    def _set_corners(self, corners, predicted, assignment):
+        self.corners = corners
+        self.predicted = predicted
+        self._assignment = assignment
+        (x1, y1), (x2, y2), (x3, y3) = corners[:3]
+        # the quad is close to a parallelogram, two adjacent sides are enough
+        shortest = min((x2 - x1) * (x2 - x1) + (y2 - y1) * (y2 - y1),
+                       (x3 - x2) * (x3 - x2) + (y3 - y2) * (y3 - y2))
+        self._max_dist = min(self.max_distance * self.max_distance, shortest / 4)
 
 
 class WiimoteDrawing:
-    def __init__(self, wiimote):
+    """
+    Computes the drawing point from the IR camera of `wiimote` (the sensor bar marks the
+    drawing area). The points are smoothed with `pointer_filter`, an instance of one of the
+    filters in pointer_filter.py (default: One Euro filter), and passed to the callbacks.
+    After start_processing(), every IR frame of the Wiimote is processed once when it arrives;
+    `update_rate` limits the rate of the callbacks (e.g. to the display refresh rate),
+    0 passes on every frame.
+    """
+
+    def __init__(self, wiimote, pointer_filter=None):
         self.DEST_W = 1920
         self.DEST_H = 1080
         self.IR_CAM_X = 1024
         self.IR_CAM_Y = 768
-        self.update_rate = 60
+        self.update_rate = 60  # max. callbacks per second, 0: every IR frame
 
         self.wiimote = wiimote
         self._acc_vals = []
-        self._ir_data = []
+        self._ir_data = []  # (n, 4) array of IR objects (id, x, y, size), see wiimote.IRCam.points
+        self._ir_state = None  # copy of the IRCam state, reused by update_all_sensors()
 
-        self._buffer_size = 60
-        self._buffer = [(-1, -1)] * self._buffer_size
-        self._last_point = None
+        self.pointer_filter = pointer_filter if pointer_filter is not None else OneEuroFilter()
         self._callbacks = []
-
-        self.update_timer_stop_flag = Event()
-        self.update_timer = ProcessingThread(self.update_drawing_point, self.update_rate, self.update_timer_stop_flag)
+        self._tracker = IRTracker()
+        self._last_seq = 0  # IR frame processed last
+        self._next_notification = None  # time the next callback is due, see update_rate
+        self._previous_mode = None  # report mode of the Wiimote before start_processing()
 
     def update_drawing_point(self):
+        """
+        Processes the current IR frame of the Wiimote, unless it has been processed already.
+        Only needed without start_processing(), e.g. to poll from a timer.
+        """
         self.update_all_sensors()
-        drawing_point = self.compute_drawing_point()
-        buffered_point = self.moving_average_buffer(drawing_point) if drawing_point else None
-        self._notify_callbacks(buffered_point)
+        if self._ir_state is None:
+            return  # no Wiimote
+        self._process_frame(int(self._ir_state['seq']), float(self._ir_state['time']))
 
     def update_all_sensors(self):
         if self.wiimote is None:
             return
-        self._acc_vals = self.wiimote.accelerometer
-        self._ir_data = self.wiimote.ir
+        self._acc_vals = list(self.wiimote.accelerometer)
+        if self._ir_state is None:
+            self._ir_state = self.wiimote.ir.state.copy()
+        self._ir_data = self.wiimote.ir.copy_state(self._ir_state)
 
     def update_accel(self, acc_vals):
         self._acc_vals = acc_vals
 
-    def update_ir(self, ir_data):
+    def update_ir(self, ir_data, seq=None, timestamp=None, acc_vals=None):
+        """
+        Processes the IR frame `ir_data` ((n, 4) array, see wiimote.IRCam.points) with sequence
+        number `seq` received at `timestamp`, and the accelerometer values `acc_vals` of the same
+        report. Frames that are not newer than the last one are ignored.
+        """
         self._ir_data = ir_data
-        drawing_point = self.compute_drawing_point()
-        buffered_point = self.moving_average_buffer(drawing_point)
-        self._notify_callbacks(buffered_point)
-
-    def moving_average_buffer(self, sample):
-        '''if not sample:
-            self._buffer.append(self._buffer[self._buffer_size-2])
-        else:
-            self._buffer.append(sample)
-        #print(sample)
-        self._buffer = self._buffer[-self._buffer_size:]
-        #print(self._buffer)
-        #self._buffer = list(scipy.ndimage.uniform_filter(self._buffer, size=self._buffer_size, mode="mirror"))
-        return self._buffer[self._buffer_size-1]'''
-
-        # following filter only uses last point and current point
-        # "trusting" the old point more than the new point by weight (0.3 means trusting new sample with 0.3
-        weight = 0.3
-
-        if self._last_point is None:
-            self._last_point = sample
-            return sample
-        else:
-            filtered_x = self._last_point[0] * (1 - weight) + sample[0] * weight
-            filtered_y = self._last_point[1] * (1 - weight) + sample[1] * weight
-            filtered_point = (filtered_x, filtered_y)
-            self._last_point = filtered_point
-            return filtered_point
+        if acc_vals is not None:
+            self._acc_vals = acc_vals
+        self._process_frame(seq, timestamp)
+
+    def _process_frame(self, seq, timestamp):
+        if seq is not None:
+            if seq <= self._last_seq:
+                return  # stale
+            self._last_seq = seq
+        if timestamp is None:
+            timestamp = time.monotonic()
+        drawing_point = self.filter_point(self.compute_drawing_point(), timestamp)
+        if self.update_rate:
+            # the points are filtered at the full report rate, only the callbacks are decimated
+            interval = 1.0 / self.update_rate
+            if self._next_notification is not None and timestamp < self._next_notification:
+                return
+            if self._next_notification is None or timestamp - self._next_notification > interval:
+                self._next_notification = timestamp  # start over after a pause
+            self._next_notification += interval
+        self._notify_callbacks(drawing_point)
+
+    def filter_point(self, drawing_point, timestamp=None):
+        """
+        Smooths `drawing_point` with the pointer filter. `timestamp` is the time the point
+        was measured (default: now). No point (None) and no valid point (-1, -1) are
+        passed through unfiltered and reset the filter, so that it starts over from the
+        next valid point instead of smoothing towards the one before the gap.
+        """
+        if drawing_point is None or drawing_point == (-1, -1):
+            self.pointer_filter.reset()
+            return drawing_point
+        return self.pointer_filter.filter(drawing_point, time.monotonic() if timestamp is None else timestamp)
 
     def register_callback(self, func):
         self._callbacks.append(func)
@@ -108,17 +283,31 @@ class WiimoteDrawing:
             callback(drawing_point, self._acc_vals)
 
     def start_processing(self):
-        if self.update_rate == 0:  # use callbacks for max. update rate
-            self.update_timer_stop_flag.set()
-            self.wiimote.ir.register_callback(self.update_ir)
-            self.wiimote.accelerometer.register_callback(self.update_accel)
-        else:
-            self.wiimote.ir.unregister_callback(self.update_ir)
-            self.wiimote.accelerometer.unregister_callback(self.update_accel)
-            self.update_timer.start()
+        """
+        Processes every IR frame of the Wiimote as it arrives. The frames are queued for a
+        worker thread of their own (see wiimote.Subscription), the callbacks are called there.
+        The report mode of the Wiimote is restored by stop_processing().
+        """
+        self.stop_processing()
+        self._previous_mode = self.wiimote.get_report_mode()
+        # report at a fixed rate instead of on changes only, so that samples are evenly spaced in time
+        self.wiimote.set_report_mode(self.wiimote.MODE_ACC_IR, continuous=True)
+        self._tracker.reset()
+        self.pointer_filter.reset()
+        self._acc_vals = list(self.wiimote.accelerometer)
+        # the accelerometer values are queued with the IR frame of the same report
+        self.wiimote.ir.register_callback(self.update_ir, raw=True, acc=True)
+
+    def stop_processing(self):
+        self.wiimote.ir.unregister_callback(self.update_ir)
+        if self._previous_mode is not None:
+            mode, continuous = self._previous_mode
+            self._previous_mode = None
+            self.wiimote.set_report_mode(mode, continuous)
 
     def compute_drawing_point(self):
-        if len(self._ir_data) is not 4:
+        if len(self._ir_data) < 3:
+            self._tracker.reset()
             return
 
         x_accel, y_accel, z_accel = self._acc_vals
@@ -129,160 +318,77 @@ class WiimoteDrawing:
 
         # print('{:2f}'.format(x_accel_norm), '{:2f}'.format(z_accel_norm))
 
-        ir_points = []
-        for i in range(len(self._ir_data)):
-            ir_x = self._ir_data[i]['x']
-            ir_y = self._ir_data[i]['y']
-            ir_point = (ir_x, ir_y)
-            ir_points.append(ir_point)
-
-        drawing_point = (-1, -1)
+        ir_points = [tuple(point) for point in self._ir_data[:, 1:3].tolist()]
 
-        ir_points = self.sort_tracking_points(ir_points)
-        if ir_points:
-            drawing_point = self.calc_drawing_point(ir_points)
-
-        return drawing_point
+        ir_points = self._tracker.update(ir_points)
+        if ir_points is None:
+            return
+        return self.calc_drawing_point(ir_points)
 
     def sort_tracking_points(self, ir_points):
-        xmin, ymin = 100000, 100000
-        xmax, ymax = 0, 0
-        x_list_unordered, y_list_unordered = [], []
-        xmin_point, xmax_point, ymin_point, ymax_point = [(-1, -1) for p in range(4)]
-
-        # ir_points = [(582, 477), (947, 311), (507, 314), (841, 143)]
-        # print("raw", ir_points)
-
-        for i in range(len(ir_points)):
-            p = ir_points[i]
-
-            x_list_unordered.append(p[0])
-            y_list_unordered.append(p[1])
-
-            if p[0] < xmin:
-                xmin = p[0]
-                xmin_point = p
-            if p[0] > xmax:
-                xmax = p[0]
-                xmax_point = p
-            if p[1] < ymin:
-                ymin = p[1]
-                ymin_point = p
-            if p[1] > ymax:
-                ymax = p[1]
-                ymax_point = p
-
-        xmin_ymin_dist = math.hypot(xmin_point[0] - ymin_point[0], xmin_point[1] - ymin_point[1])
-        xmin_ymax_dist = math.hypot(xmin_point[0] - ymax_point[0], xmin_point[1] - ymax_point[1])
-
-        quadrant_num = 0 if (xmin_ymin_dist < xmin_ymax_dist) else 1
-
-        if quadrant_num == 0:
-            sorted_tracking_points = [ymin_point, xmax_point, ymax_point, xmin_point]
-        elif quadrant_num == 1:
-            sorted_tracking_points = [xmin_point, ymin_point, xmax_point, ymax_point]
-
-        # print("sorted", sorted_tracking_points)
-
-        sorted_tracking_points = self.remove_sorting_errors(sorted_tracking_points, ir_points, quadrant_num,
-                                                            x_list_unordered, y_list_unordered)
-
-        return sorted_tracking_points
-
-    def remove_sorting_errors(self, sorted_tracking_points, ir_points, quadrant_num, x_list_unordered, y_list_unordered,
-                              recursion_counter=0):
-        x_list_asc = sorted(x_list_unordered)
-        y_list_asc = sorted(y_list_unordered)
-
-        point_order_dict_quadrant_1 = [['y', 'min'], ['x', 'max'], ['y', 'max'], ['x', 'min']]
-        point_order_dict_quadrant_2 = [['x', 'min'], ['y', 'min'], ['x', 'max'], ['y', 'max']]
-        point_order_dict_list = [point_order_dict_quadrant_1, point_order_dict_quadrant_2]
-
-        avoidance_dict_quadrant_1 = [['x', 'max'], ['y', 'max'], ['x', 'min'], ['y', 'min']]
-        avoidance_dict_quadrant_2 = [['y', 'max'], ['x', 'min'], ['y', 'min'], ['x', 'max']]
-        avoidance_dict_list = [avoidance_dict_quadrant_1, avoidance_dict_quadrant_2]
-
-        duplicate_points = self.list_duplicates(sorted_tracking_points)
-        for dp in duplicate_points:
-            indices = [i for i, sp in enumerate(sorted_tracking_points) if str(sp) == str(dp)]
-            faulty_point_index = -1
-            lowest_avoidance_rating = 1000
-
-            if len(indices) > 2:
-                # print("more than 2 boundary values are identical. " +
-                # "that shouldn't happen, something's terrible wrong here :(")
-                return
-
-            for i in indices:
-                p = sorted_tracking_points[i]
-                avoidance_axis = avoidance_dict_list[quadrant_num][i][0]
-                avoidance_rating = x_list_asc.index(p[0]) if (avoidance_axis == "x") else y_list_asc.index(p[1])
-                if avoidance_dict_list[quadrant_num][i][1] == "max":
-                    avoidance_rating = len(sorted_tracking_points) - avoidance_rating
-
-                if avoidance_rating < lowest_avoidance_rating:
-                    lowest_avoidance_rating = avoidance_rating
-                    faulty_point_index = i
-
-            faulty_point = sorted_tracking_points[faulty_point_index]
-            order_axis = point_order_dict_list[quadrant_num][faulty_point_index][0]
-            boundary_type = point_order_dict_list[quadrant_num][faulty_point_index][1]
-            search_list = x_list_asc if (order_axis == "x") else y_list_asc
-            closest_similar_value = search_list[1] if (boundary_type == "min") else \
-                search_list[len(sorted_tracking_points) - 2]
-            # print(faulty_point)
-            # print(order_axis, boundary_type)
-            # print(closest_similar_value)
-
-            for p in ir_points:
-                order_axis_val = p[0] if (order_axis == "x") else p[1]
-                if order_axis_val == closest_similar_value:
-                    sorted_tracking_points[faulty_point_index] = p
-                    # print("corrected", sorted_tracking_points)
-
-        duplicate_points = self.list_duplicates(sorted_tracking_points)
-
-        if len(duplicate_points) > 0 and recursion_counter < 4:
-            self.remove_sorting_errors(sorted_tracking_points, ir_points, quadrant_num, x_list_unordered,
-                                       y_list_unordered, recursion_counter + 1)
-
-        return sorted_tracking_points
-
-    # Source: https://stackoverflow.com/a/9836685
-    def list_duplicates(self, seq):
-        seen = set()
-        seen_add = seen.add
-        # adds all elements it doesn't know yet to seen and all other to seen_twice
-        seen_twice = set(x for x in seq if x in seen or seen_add(x))
-        # turn the set into a list (as requested)
-        return list(seen_twice)
+        return sort_corners(ir_points)
 
     def calc_drawing_point(self, ir_points):
-        sx1, sy1 = ir_points[0]
-        sx2, sy2 = ir_points[1]
-        sx3, sy3 = ir_points[2]
-        sx4, sy4 = ir_points[3]
-
-        # Step 1
-        source_points_123 = pl.matrix([[sx1, sx2, sx3],
-                                       [sy1, sy2, sy3],
-                                       [1, 1, 1]])
-        source_point_4 = [[sx4],
-                          [sy4],
-                          [1]]
-        scale_to_source = pl.solve(source_points_123, source_point_4)
-
-        # Step 2
-        l, m, t = [float(x) for x in scale_to_source]
-        unit_to_source = pl.matrix([[l * sx1, m * sx2, t * sx3],
-                                    [l * sy1, m * sy2, t * sy3],
-                                    [l * 1, m * 1, t * 1]])
-
-        # Step 3
-        # we adjust the destination rectangle in order to use the whole ir sensor area for drawing
+        """
+        Maps the center of the IR camera image to the drawing area, using the projective
+        transformation from the four sorted `ir_points` (corners of the sensor bar rectangle)
+        to the destination rectangle. Returns (-1, -1) if the points are degenerate
+        (three of them on a line).
+        """
+        (sx1, sy1), (sx2, sy2), (sx3, sy3), (sx4, sy4) = ir_points
+
+        # Step 1: the destination rectangle uses the whole ir sensor area for drawing
         rectangle_long_side_dist = math.hypot(sx2 - sx1, sy2 - sy1)
         rectangle_short_side_dist = math.hypot(sx3 - sx2, sy3 - sy2)
-
+        unit_to_dest = self._unit_to_dest(rectangle_long_side_dist, rectangle_short_side_dist)
+
+        # Step 2: express the 4th source point and the camera center in the basis of the
+        # first three source points; their ratio is the center in unit coordinates
+        scale_to_source = _basis_coefficients(sx1, sy1, sx2, sy2, sx3, sy3, sx4, sy4)
+        center = _basis_coefficients(sx1, sy1, sx2, sy2, sx3, sy3, self.IR_CAM_X / 2, self.IR_CAM_Y / 2)
+        if scale_to_source is None or 0 in scale_to_source:
+            return -1, -1
+        u1, u2, u3 = [c / s for c, s in zip(center, scale_to_source)]
+
+        # Step 3: unit coordinates to the drawing area
+        (ax1, ax2, ax3), (ay1, ay2, ay3), (az1, az2, az3) = unit_to_dest
+        x = ax1 * u1 + ax2 * u2 + ax3 * u3
+        y = ay1 * u1 + ay2 * u2 + ay3 * u3
+        z = az1 * u1 + az2 * u2 + az3 * u3
+        if z == 0:
+            return -1, -1
+
+        # Step 4: dehomogenization
+        return x / z, self.DEST_H - y / z
+
+    def calc_drawing_points(self, ir_points):
+        """
+        Batch version of calc_drawing_point for an (N, 4, 2) array of sorted IR points,
+        e.g. a recorded session. Returns an (N, 2) array, rows of degenerate frames are (-1, -1).
+        """
+        ir_points = np.asarray(ir_points, dtype=np.float64)
+        (sx1, sy1), (sx2, sy2), (sx3, sy3), (sx4, sy4) = np.moveaxis(ir_points, (1, 2), (0, 1))
+        origin_x, origin_y, max_x, max_y = self._dest_rectangle(np.hypot(sx2 - sx1, sy2 - sy1),
+                                                                np.hypot(sx3 - sx2, sy3 - sy2))
+        dest = [(origin_x, origin_y), (max_x, origin_y), (max_x, max_y), (origin_x, max_y)]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            scale_to_dest = (1, -1, 1)  # the destination is a rectangle, see _unit_to_dest()
+            scale_to_source = _basis_coefficients(sx1, sy1, sx2, sy2, sx3, sy3, sx4, sy4, batch=True)
+            center = _basis_coefficients(sx1, sy1, sx2, sy2, sx3, sy3, self.IR_CAM_X / 2, self.IR_CAM_Y / 2,
+                                         batch=True)
+            weights = [d * c / s for d, c, s in zip(scale_to_dest, center, scale_to_source)]
+            z = sum(weights)
+            x = sum(w * dx for w, (dx, dy) in zip(weights, dest)) / z
+            y = self.DEST_H - sum(w * dy for w, (dx, dy) in zip(weights, dest)) / z
+        points = np.stack([x, y], axis=-1)
+        points[~np.isfinite(points).all(axis=-1)] = -1
+        return points
+
+    def _dest_rectangle(self, rectangle_long_side_dist, rectangle_short_side_dist):
+        """
+        Returns origin_x, origin_y, max_x, max_y of the destination rectangle for a sensor bar
+        rectangle with the given side lengths.
+        """
         rectangle_to_sensor_diff_x = (self.IR_CAM_X - rectangle_long_side_dist)
         rectangle_to_sensor_diff_y = (self.IR_CAM_Y - rectangle_short_side_dist)
 
@@ -291,45 +397,16 @@ class WiimoteDrawing:
 
         max_x = self.DEST_W - origin_x
         max_y = self.DEST_H - origin_y
-        '''
-        #print("IR", self.IR_CAM_X, self.IR_CAM_Y)
-        #print("rectangle", rectangle_long_side_dist, rectangle_short_side_dist)
-        #print("diff", rectangle_to_sensor_diff_x, rectangle_to_sensor_diff_y)
-        #print("origin", origin_x, origin_y)
-        #print("dest", self.DEST_W, self.DEST_H)
-        '''
-        dx1, dy1 = origin_x, origin_y
-        dx2, dy2 = max_x, origin_y
-        dx3, dy3 = max_x, max_y
-        dx4, dy4 = origin_x, max_y
-
-        dest_points_123 = pl.matrix([[dx1, dx2, dx3],
-                                     [dy1, dy2, dy3],
-                                     [1, 1, 1]])
-        dest_point_4 = pl.matrix([[dx4],
-                                  [dy4],
-                                  [1]])
-        scale_to_dest = pl.solve(dest_points_123, dest_point_4)
-        l, m, t = [float(x) for x in scale_to_dest]
-        unit_to_dest = pl.matrix([[l * dx1, m * dx2, t * dx3],
-                                  [l * dy1, m * dy2, t * dy3],
-                                  [l * 1, m * 1, t * 1]])
-
-        # Step 4
-        source_to_unit = pl.inv(unit_to_source)
-
-        # Step 5
-        source_to_dest = unit_to_dest @ source_to_unit
-
-        # Step 6
-        x, y, z = [float(w) for w in (source_to_dest @ pl.matrix([[self.IR_CAM_X/2],
-                                                                  [self.IR_CAM_Y/2],
-                                                                  [1]]))]
-        # Step 7: dehomogenization
-        x = x / z
-        y = y / z
-
-        y = self.DEST_H - y
-
-        # print("drawing point", x, y)
-        return x, y
+        return origin_x, origin_y, max_x, max_y
+
+    def _unit_to_dest(self, rectangle_long_side_dist, rectangle_short_side_dist):
+        """
+        Returns the matrix (as nested tuples) mapping the unit basis to the destination rectangle.
+        The 4th corner of a rectangle is corner 1 - corner 2 + corner 3, so the basis
+        coefficients are always (1, -1, 1) and the matrix is made of the corners themselves.
+        """
+        origin_x, origin_y, max_x, max_y = self._dest_rectangle(rectangle_long_side_dist,
+                                                                rectangle_short_side_dist)
+        return ((origin_x, -max_x, max_x),
+                (origin_y, -origin_y, max_y),
+                (1, -1, 1))
@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+# coding: utf-8
+
+# Stand-in for a Wiimote on a local socket pair
+#
+# LoopbackDevice is the base of the devices that take the place of a Bluetooth
+# connection: ReplayDevice (wiimote_capture) plays back a recorded session,
+# SimulatedDevice (wiimote_sim) generates reports. Pass `device.connect` as
+# `transport` to WiiMote.
+
+import select
+import socket
+import threading
+import time
+import wiimote
+
+
+class LoopbackDevice(threading.Thread):
+    """
+    Takes the place of a Wiimote on a local socket pair, e.g. to replay a captured
+    session (see wiimote_capture) or to simulate a controller. Pass `device.connect`
+    as `transport` to WiiMote.
+    The device answers memory reads and writes, status requests and report mode changes
+    the way a Wiimote does; subclasses send the data reports in produce().
+    """
+
+    MODEL = 'Nintendo RVL-CNT-01-TR'
+
+    def __init__(self):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.memory = {}  # (eeprom?, address) -> byte
+        self.report_mode = wiimote.CommunicationHandler.MODE_DEFAULT
+        self.continuous = False
+        self.leds = 0
+        self.rumble = False
+        self.running = False
+        self._socket = None
+
+    def connect(self, btaddr):
+        """
+        Starts the device and returns the host end of the socket pair
+        as both control and data socket.
+        """
+        host, self._socket = socket.socketpair(socket.AF_UNIX, socket.SOCK_SEQPACKET)
+        self.running = True
+        self.start()
+        return host, host
+
+    def run(self):
+        try:
+            self.produce()
+        except OSError as e:  # the host has closed its end
+            wiimote._debug("loopback device stopped: " + str(e))
+        finally:
+            self.running = False
+            self._socket.close()
+
+    def produce(self):
+        """
+        Sends data reports until the device is stopped. The default only answers output reports.
+        """
+        while self.running:
+            self.wait(1.0)
+
+    def stop(self):
+        """
+        Disconnects the device, as if the Wiimote had been switched off.
+        """
+        self.running = False
+
+    def send_report(self, report):
+        """
+        Sends `report`, a bytes-like object starting with the report ID, to the host.
+        """
+        self._socket.send(b'\xa1' + bytes(report))
+
+    def wait(self, timeout):
+        """
+        Handles output reports from the host for `timeout` seconds
+        (or only those already received if `timeout` is 0).
+        Returns False if the device has been stopped or the host has disconnected.
+        """
+        deadline = time.monotonic() + timeout
+        while self.running:
+            remaining = max(deadline - time.monotonic(), 0)
+            readable, _, _ = select.select([self._socket], [], [], remaining)
+            if readable:
+                packet = self._socket.recv(32)
+                if not packet:
+                    self.running = False
+                    break
+                self._handle_output_report(packet[1:])
+            elif remaining == 0:
+                break
+        return self.running
+
+    def _handle_output_report(self, report):
+        rpt_type = report[0]
+        memory = wiimote.Memory
+        self.rumble = bool(report[1] & 0x01)
+        if rpt_type == 0x11:
+            self.leds = report[1] >> 4
+        elif rpt_type == 0x12:
+            self.continuous = bool(report[1] & wiimote.CommunicationHandler.RPT_CONTINUOUS)
+            self.report_mode = report[2]
+        elif rpt_type == wiimote.CommunicationHandler.RPT_STATUS_REQ:
+            self.send_report(bytes([0x20, 0, 0, self.leds << 4, 0, 0, 0xc8]))
+        elif rpt_type == memory.RPT_WRITE:
+            eeprom = not report[1] & 0x04
+            address = int.from_bytes(report[2:5], 'big')
+            for i, value in enumerate(report[6:6 + report[5]]):
+                self.memory[(eeprom, address + i)] = value
+            self.send_report(bytes([memory.RPT_ACK, 0, 0, memory.RPT_WRITE, 0]))
+        elif rpt_type == memory.RPT_READ:
+            eeprom = not report[1] & 0x04
+            address = int.from_bytes(report[2:5], 'big')
+            amount = int.from_bytes(report[5:7], 'big')
+            for offset in range(0, amount, memory.MAX_CHUNK_SIZE):
+                size = min(amount - offset, memory.MAX_CHUNK_SIZE)
+                data = bytes(self.memory.get((eeprom, address + offset + i), 0) for i in range(size))
+                reply = bytes([memory.RPT_READ_DATA, 0, 0, (size - 1) << 4])
+                reply += ((address + offset) & 0xffff).to_bytes(2, 'big')
+                self.send_report(reply + data.ljust(memory.MAX_CHUNK_SIZE, b'\x00'))
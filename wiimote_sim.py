@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+# coding: utf-8
+
+# Simulated Wiimote for load tests without Bluetooth hardware
+#
+# SimulatedDevice generates buttons/accelerometer (0x31) and buttons/accelerometer/IR (0x33)
+# reports at a fixed rate on a local socket pair. The WiiMote connected to it is the same
+# class as for a real controller, so everything built on top of it (WiimoteDrawing, the
+# gesture recognizer, the game) can be run headless.
+
+import math
+import random
+import time
+import wiimote
+import wiimote_loopback
+
+
+def connect_simulated(rate=100, manager=None, controller_id=0, **kwargs):
+    """
+    Returns a WiiMote connected to a new SimulatedDevice sending `rate` reports per second.
+    Further keyword arguments are passed to SimulatedDevice. The device is available
+    as the WiiMote's `device` attribute (e.g. to press buttons).
+    If a WiimoteManager `manager` is given, the WiiMote is added to it instead of
+    getting its own receive thread.
+    """
+    device = SimulatedDevice(rate, **kwargs)
+    wm = wiimote.WiiMote('sim:%x' % id(device), device.MODEL, threaded=manager is None,
+                         controller_id=controller_id, transport=device.connect)
+    wm.device = device
+    if manager is not None:
+        manager.add(wm)
+    return wm
+
+
+class SimulatedDevice(wiimote_loopback.LoopbackDevice):
+    """
+    A Wiimote pointed at a sensor bar that moves in slow circles.
+    The four IR points form a rectangle that circles around the center of the camera image,
+    the accelerometer tilts along with it. Reports are sent in the mode requested by
+    the host (0x30, 0x31 or 0x33) at `rate` Hz, whether or not the host asked for continuous
+    reporting. Up to a few kHz are possible, late reports are sent back to back.
+
+    `dropout` is the probability per report that the link drops out for
+    `dropout_duration` seconds, i.e. no reports are sent. `ir_points` is the number
+    of visible IR points, `seed` makes the dropouts reproducible.
+    """
+
+    SUPPORTED_MODES = [0x30, 0x31, 0x33]
+    CENTER = (512, 384)
+    RADIUS = (200, 150)
+    BAR_SIZE = (300, 200)
+    PERIOD = 5.0  # seconds per circle
+
+    def __init__(self, rate=100, dropout=0.0, dropout_duration=0.1, ir_points=4, seed=None):
+        wiimote_loopback.LoopbackDevice.__init__(self)
+        self.rate = rate
+        self.dropout = dropout
+        self.dropout_duration = dropout_duration
+        self.ir_points = ir_points
+        self.buttons = 0  # bit mask as in the report, see Buttons.BUTTONS
+        self.sent = 0
+        self.dropped = 0
+        self._random = random.Random(seed)
+        self._report = bytearray(19)  # transaction header + largest supported report
+
+    def press(self, *buttons):
+        for button in buttons:
+            self.buttons |= wiimote.Buttons.BUTTONS[button]
+
+    def release(self, *buttons):
+        for button in buttons:
+            self.buttons &= ~wiimote.Buttons.BUTTONS[button]
+
+    def produce(self):
+        interval = 1.0 / self.rate
+        start = next_report = time.monotonic()
+        dropout_until = 0.0
+        while self.wait(next_report - time.monotonic()):
+            now = next_report
+            next_report += interval
+            if now < dropout_until:
+                self.dropped += 1
+                continue
+            if self.dropout and self._random.random() < self.dropout:
+                dropout_until = now + self.dropout_duration
+                self.dropped += 1
+                continue
+            length = self._build_report(now - start)
+            if length:
+                self._socket.send(self._report[:length])
+                self.sent += 1
+
+    def _build_report(self, t):
+        """
+        Writes the report for time `t` into the report buffer and returns its length
+        (0 if the current report mode is not supported).
+        """
+        mode = self.report_mode
+        if mode not in self.SUPPORTED_MODES:
+            return 0
+        report = self._report
+        report[0] = 0xa1
+        report[1] = mode
+        btn_1 = (self.buttons >> 8) & 0x1f
+        btn_2 = self.buttons & 0x9f
+        if mode == 0x30:
+            report[2], report[3] = btn_1, btn_2
+            return 4
+        angle = 2 * math.pi * t / self.PERIOD
+        acc_x = 512 + int(100 * math.sin(angle))
+        acc_y = 512 + int(100 * math.cos(angle))
+        acc_z = 612
+        # the least significant bits of the accelerometer values are stored in the button bytes
+        report[2] = btn_1 | (acc_x & 0x03) << 5
+        report[3] = btn_2 | (acc_y & 0x02) << 4 | (acc_z & 0x02) << 5
+        report[4], report[5], report[6] = acc_x >> 2, acc_y >> 2, acc_z >> 2
+        if mode == 0x31:
+            return 7
+        x = self.CENTER[0] + self.RADIUS[0] * math.cos(angle)
+        y = self.CENTER[1] + self.RADIUS[1] * math.sin(angle)
+        w, h = self.BAR_SIZE[0] / 2, self.BAR_SIZE[1] / 2
+        corners = [(x - w, y - h), (x + w, y - h), (x + w, y + h), (x - w, y + h)]
+        for i, (ir_x, ir_y) in enumerate(corners):
+            offset = 7 + 3 * i
+            if i >= self.ir_points:
+                report[offset:offset + 3] = b'\xff\xff\xff'
+                continue
+            ir_x, ir_y = int(ir_x) & 0x3ff, int(ir_y) & 0x3ff
+            report[offset] = ir_x & 0xff
+            report[offset + 1] = ir_y & 0xff
+            report[offset + 2] = (ir_y >> 8) << 6 | (ir_x >> 8) << 4 | 3  # size 3
+        return 19